@@ -0,0 +1,162 @@
+from typing import Optional, Dict, List, Deque
+from collections import deque
+import threading
+import logging
+import queue
+import time
+
+import discord_webhook
+
+import utils
+
+logger = logging.getLogger("bot.announcements")
+
+STOP = None
+GIVE_UP = -1.0
+
+
+class Announcement:
+    def __init__(self, description: str, content: str, embeds: List[discord_webhook.DiscordEmbed]):
+        self.description = description
+        self.content = content
+        # Built once and shared read only by every hook worker.
+        self.embeds = embeds
+        self.queued_at = time.monotonic()
+
+
+class HookWorker:
+    def __init__(self, dispatcher: "AnnouncementDispatcher", number: int, url: str):
+        self.dispatcher = dispatcher
+        self.number = number
+        # One webhook object per hook, webhook_post mutates it so it can't be shared.
+        self.webhook = discord_webhook.DiscordWebhook(url=url)
+        self.queue: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self.work, name=f"bot-announce-{number}", daemon=True)
+
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies: Deque[float] = deque(maxlen=dispatcher.latency_window)
+
+    def work(self):
+        while True:
+            announcement = self.queue.get()
+            try:
+                if announcement is STOP:
+                    return
+                self.deliver(announcement)
+            finally:
+                self.queue.task_done()
+
+    def deliver(self, announcement: Announcement):
+        for attempt in range(self.dispatcher.max_retries + 1):
+            backoff = min(self.dispatcher.max_backoff, self.dispatcher.backoff * 2 ** attempt)
+            wait = self.post(announcement, backoff)
+            if wait is None:
+                latency = time.monotonic() - announcement.queued_at
+                with self.lock:
+                    self.sent += 1
+                    self.latencies.append(latency)
+                logger.info(
+                    f"Announced {announcement.description} to hook {self.number} in {latency:.2f}s."
+                )
+                return
+            if wait == GIVE_UP or attempt == self.dispatcher.max_retries:
+                break
+            with self.lock:
+                self.retries += 1
+            time.sleep(wait)
+
+        with self.lock:
+            self.failed += 1
+        logger.error(f"Failed announcing {announcement.description} to hook {self.number}.")
+
+    def post(self, announcement: Announcement, backoff: float) -> Optional[float]:
+        # None once delivered, GIVE_UP when retrying is pointless, otherwise seconds to wait.
+        try:
+            responses = utils.webhook_post(
+                webhook=self.webhook,
+                plain_text_message=announcement.content,
+                embeds=announcement.embeds,
+            )
+        except Exception as e:
+            logger.warning(f"Announcement hook {self.number} excepted {e}")
+            return backoff
+
+        # execute() answers with a response per url, this worker's webhook only has the one.
+        response = responses[0] if isinstance(responses, list) else responses
+        if response is None or response.ok:
+            return None
+        logger.warning(f"Announcement hook {self.number} returned {response.status_code}")
+        if response.status_code == 429:
+            return max(backoff, self.retry_after(response))
+        if response.status_code < 500:
+            # Bad payload or a deleted hook, another attempt gets the same answer.
+            return GIVE_UP
+        return backoff
+
+    @staticmethod
+    def retry_after(response) -> float:
+        header = response.headers.get("Retry-After")
+        if header is not None:
+            return float(header)
+        try:
+            return float(response.json().get("retry_after", 0.0))
+        except ValueError:
+            return 0.0
+
+    def report(self) -> Dict:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                "depth": self.queue.qsize(),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retries": self.retries,
+                "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+                "latency_max": latencies[-1] if latencies else None,
+            }
+
+
+class AnnouncementDispatcher:
+    def __init__(
+        self,
+        hooks: List[str],
+        mention: List[str],
+        max_retries: int = 3,
+        backoff: float = 2.0,
+        max_backoff: float = 60.0,
+        latency_window: int = 100,
+    ):
+        self.mention = ", ".join(mention)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latency_window = latency_window
+
+        # A worker per hook, so a slow or rate limited hook never holds up the others.
+        self.workers = [HookWorker(self, number, url) for number, url in enumerate(hooks)]
+        for worker in self.workers:
+            worker.thread.start()
+
+    def announce(self, description: str, embeds: List[discord_webhook.DiscordEmbed]):
+        announcement = Announcement(description, self.mention, embeds)
+        for worker in self.workers:
+            worker.queue.put(announcement)
+
+    def report(self) -> Dict[str, Dict]:
+        # Keyed by position, the hook urls carry their tokens.
+        return {f"hook_{worker.number}": worker.report() for worker in self.workers}
+
+    def shutdown(self, timeout: float = 10.0):
+        deadline = time.monotonic() + timeout
+        while any(worker.queue.unfinished_tasks for worker in self.workers):
+            if time.monotonic() >= deadline:
+                logger.warning("Dropping undelivered announcements.")
+                break
+            time.sleep(0.1)
+        for worker in self.workers:
+            worker.queue.put(STOP)
+        for worker in self.workers:
+            worker.thread.join(timeout=1.0)
@@ -0,0 +1,410 @@
+from typing import Optional, Dict, List, Callable
+from pathlib import Path
+import multiprocessing
+import tempfile
+import argparse
+import resource
+import logging
+import random
+import sys
+import time
+
+from envelope import MessageEnvelope
+import bot
+import coalescer
+import commands
+import fakes
+import flood_control
+import metrics
+import role_index
+import utils
+
+CHAT_LINES = [
+    "hello everyone!",
+    "this song is so good",
+    "lol",
+    "can you play wonderwall",
+    "first time here, love the vibes",
+    "what guitar is that?",
+    "❤️❤️❤️",
+    "gm from germany",
+    "play it again!!",
+    "how long have you been playing?",
+    "the audio is a bit quiet",
+    "encore!",
+    "who else is here from the discord",
+    "type !discord for the server",
+    "10/10",
+    "that key change omg",
+]
+BASIC_COMMANDS = ["!discord", "!youtube", "!socials", "!subreddit", "!credits", "!ping", "!Discord"]
+BUILT_IN_COMMANDS = ["!subscribe", "!unsubscribe", "!monitor abc123", "!end", "!subother u/someone"]
+AUTHORS = [f"viewer_{number}" for number in range(500)]
+
+
+class FakeComment:
+    def reply(self, reply: str):
+        pass
+
+
+class FakeOutbound:
+    def __init__(self):
+        self.replies = 0
+
+    def reply(self, message, reply: str):
+        message.reply(reply)
+        self.replies += 1
+
+
+class FakeParent:
+    def __init__(self, config_dir: Path):
+        self.basic_commands = utils.load_json(config_dir / "basic_commands.json")
+        self.users = {
+            "admins": ["streamer"],
+            "moderators": ["mod_one", "mod_two"],
+            "subscribers": [f"subscriber_{number}" for number in range(2000)],
+        }
+        self.role_index = role_index.RoleIndex()
+        self.role_index.rebuild(self.users)
+        self.outbound = FakeOutbound()
+        # No window, the legacy chain never coalesced so neither does the comparison.
+        self.coalescer = coalescer.ReplyCoalescer(self.outbound, window=0.0)
+        self.flood_control = flood_control.FloodControl(enabled=False)
+        self.monitored_streams = {"monitored": {}, "unmonitored": {}}
+        self.monitored_posts = {}
+
+    def add_to_role(self, role: str, user_name: str):
+        self.users[role].append(user_name)
+        self.role_index.add(user_name, role)
+
+    def remove_from_role(self, role: str, user_name: str):
+        self.users[role].remove(user_name)
+        self.role_index.remove(user_name, role)
+
+
+def legacy_check_message(bot_commands: commands.Commands, new_message: MessageEnvelope):
+    # The if/elif substring chain check_message used before the registry, kept for comparison.
+    message_body_lower = new_message.body.lower()
+    new_message.args = new_message.body.split(" ")[1:]
+
+    if len(message_body_lower) > 45:
+        return None, None
+    elif message_body_lower in bot_commands.parent.basic_commands:
+        this_command = bot_commands.parent.basic_commands[message_body_lower]
+        bot_commands.basic_commands_func(this_command, new_message)
+        return None, None
+    elif message_body_lower == "!subscribe":
+        return bot_commands.subscribe(new_message)
+    elif message_body_lower == "!unsubscribe":
+        return bot_commands.unsubscribe(new_message)
+    elif "!subother" in message_body_lower:
+        return bot_commands.subother(new_message)
+    elif "!unsubother" in message_body_lower:
+        return bot_commands.unsubother(new_message)
+    elif "!monitor" in message_body_lower:
+        return bot_commands.monitor(new_message)
+    elif "!end" in message_body_lower:
+        return bot_commands.end(new_message)
+    elif message_body_lower == "!reload commands":
+        return bot_commands.reload_commands(new_message)
+    return None, None
+
+
+def build_corpus(size: int, seed: int) -> List[MessageEnvelope]:
+    # Roughly what a busy stream looks like: mostly chat, some basic commands, a few built ins
+    # from viewers without permission and the odd wall of text.
+    generator = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        roll = generator.random()
+        if roll < 0.85:
+            body = generator.choice(CHAT_LINES)
+        elif roll < 0.95:
+            body = generator.choice(BASIC_COMMANDS)
+        elif roll < 0.98:
+            body = generator.choice(BUILT_IN_COMMANDS)
+        else:
+            body = " ".join(generator.choice(CHAT_LINES) for _ in range(6))
+        corpus.append(
+            MessageEnvelope(
+                body, generator.choice(AUTHORS), "stream", "abc123", message=FakeComment()
+            )
+        )
+    return corpus
+
+
+def measure(
+    dispatch: Callable[[MessageEnvelope], object], corpus: List[MessageEnvelope], repeat: int
+) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for new_message in corpus:
+            dispatch(new_message)
+        best = min(best, time.perf_counter() - start)
+    return len(corpus) / best
+
+
+def benchmark_dispatch(args: argparse.Namespace):
+    parent = FakeParent(args.config_dir)
+    bot_commands = commands.Commands(parent)
+    corpus = build_corpus(args.messages, args.seed)
+
+    legacy_rate = measure(
+        lambda new_message: legacy_check_message(bot_commands, new_message), corpus, args.repeat
+    )
+    registry_rate = measure(bot_commands.check_message, corpus, args.repeat)
+
+    print(f"corpus: {len(corpus)} messages, best of {args.repeat}")
+    print(f"legacy if/elif chain: {legacy_rate:12,.0f} messages/s")
+    print(
+        f"command registry:     {registry_rate:12,.0f} messages/s "
+        f"({registry_rate / legacy_rate:.2f}x)"
+    )
+
+
+def serve_fakes(
+    connection, post_ids: List[str], rate: float, duration: float, seed: int, noise: float
+):
+    # Runs in its own process, so the fakes' CPU time isn't billed to the bot.
+    live_comments = fakes.FakeLiveCommentServer()
+    strapi = fakes.FakeStrapi(live_comments)
+    connection.send(strapi.url)
+    connection.recv()
+
+    corpus = build_corpus(max(1, int(rate * duration)), seed)
+    generator = random.Random(seed)
+    sent_at: Dict[str, float] = {}
+    started = time.monotonic()
+    sent = 0
+    while True:
+        elapsed = time.monotonic() - started
+        if elapsed >= duration:
+            break
+        while sent < min(len(corpus), int(elapsed * rate)):
+            new_message = corpus[sent]
+            comment_id = f"c{fakes.base36(sent)}"
+            post_id = post_ids[sent % len(post_ids)]
+            sent_at[comment_id] = time.monotonic()
+            live_comments.send_comment(post_id, comment_id, new_message.author, new_message.body)
+            if generator.random() < noise:
+                live_comments.send_deletion(post_id, comment_id)
+            sent += 1
+        time.sleep(0.001)
+
+    connection.send({"sent_at": sent_at, "frames": live_comments.frames_sent})
+    connection.recv()
+    live_comments.close()
+    strapi.close()
+
+
+def write_load_config(config_dir: Path, load_dir: Path, post_ids: List[str]):
+    parent = FakeParent(config_dir)
+    utils.save_json(
+        load_dir / "secrets.json",
+        {
+            "user_name": "fake_bot",
+            "user_password": "",
+            "app_id": "",
+            "app_secret": "",
+            "user_agent": "script:benchmark:RPAN_Stream_Bot (load harness)",
+        },
+    )
+    utils.save_json(load_dir / "basic_commands.json", parent.basic_commands)
+    utils.save_json(load_dir / "users.json", parent.users)
+    utils.save_json(load_dir / "monitored_posts.json", {})
+    utils.save_json(
+        load_dir / "monitored_streams.json",
+        {"monitored": {post_id: None for post_id in post_ids}, "unmonitored": {}},
+    )
+
+
+def load_config(config_dir: Path, strapi_url: str, args: argparse.Namespace) -> Dict:
+    config = utils.load_json(config_dir / "config.json")
+    config["run_mode"] = "loop"
+    config["storage"] = {"backend": "json"}
+    config["monitored_redditor"] = ""
+    config["monitored_redditors"] = []
+    config["announcements_webhook"] = {"hooks": [], "mention": [], "image": None}
+    config["errors_webhook"] = {"hooks": [], "mention": []}
+    config["resolver"] = dict(config.get("resolver", {}), strapi_url=strapi_url)
+    # Reddit's reply rate limit would swamp everything else, the bot's own cost is the point.
+    config["outbound"] = dict(
+        config.get("outbound", {}), rate=args.reply_rate, burst=args.reply_rate
+    )
+    # Port 0 picks any free port, the point is measuring what collection costs.
+    config["metrics"] = {"enabled": args.metrics, "host": "127.0.0.1", "port": 0}
+    return config
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def step(load_bot: bot.Bot, inbox_stream, poll_timeout: float):
+    # The socket half of Bot.run, the praw feeds have nothing to say to the fakes.
+    load_bot.add_new_sockets()
+    load_bot.remove_old_sockets()
+    load_bot.check_sockets(poll_timeout)
+    load_bot.check_inbox(inbox_stream)
+    load_bot.persistence.flush_due()
+
+
+def frames_handled(load_bot: bot.Bot) -> int:
+    return sum(socket_stats["frames"] for socket_stats in load_bot.multiplexer.report().values())
+
+
+def benchmark_load(args: argparse.Namespace):
+    post_ids = [f"s{fakes.base36(number)}" for number in range(args.streams)]
+    context = multiprocessing.get_context("spawn")
+    connection, child_connection = context.Pipe()
+    fake_process = context.Process(
+        target=serve_fakes,
+        args=(child_connection, post_ids, args.rate, args.duration, args.seed, args.noise),
+        name="bot-benchmark-fakes",
+        daemon=True,
+    )
+    fake_process.start()
+    strapi_url = connection.recv()
+
+    with tempfile.TemporaryDirectory() as load_dir:
+        load_dir = Path(load_dir)
+        write_load_config(args.config_dir, load_dir, post_ids)
+        reddit = fakes.FakeReddit()
+        load_bot = bot.Bot(
+            Path(__file__).resolve().parent,
+            load_dir,
+            load_config(args.config_dir, strapi_url, args),
+            reddit=reddit,
+        )
+        inbox_stream = reddit.inbox.stream(pause_after=0, skip_existing=True)
+
+        started = time.monotonic()
+        while len(load_bot.multiplexer.sockets) < args.streams:
+            if time.monotonic() - started > args.connect_timeout:
+                connected = len(load_bot.multiplexer.sockets)
+                print(f"only {connected} of {args.streams} sockets connected.")
+                break
+            step(load_bot, inbox_stream, 0.01)
+        connect_time = time.monotonic() - started
+
+        generator = random.Random(args.seed)
+        inbox_sent_at: Dict[str, float] = {}
+        cpu_before = cpu_seconds()
+        started = time.monotonic()
+        connection.send("start")
+        results = None
+        drained_at = None
+        while True:
+            now = time.monotonic()
+            while len(inbox_sent_at) < int(min(now - started, args.duration) * args.inbox_rate):
+                message_id = reddit.push_inbox(
+                    generator.choice(AUTHORS), generator.choice(BASIC_COMMANDS)
+                )
+                inbox_sent_at[message_id] = time.monotonic()
+
+            step(load_bot, inbox_stream, 0.01)
+
+            if results is None and connection.poll():
+                results = connection.recv()
+                drained_at = time.monotonic() + args.drain
+            if drained_at is not None and (
+                time.monotonic() >= drained_at
+                or frames_handled(load_bot) >= results["frames"]
+                and not load_bot.outbound.queue.unfinished_tasks
+            ):
+                break
+        elapsed = time.monotonic() - started
+        cpu_used = cpu_seconds() - cpu_before
+        if args.metrics:
+            scrape = metrics.REGISTRY.render()
+
+        handled = frames_handled(load_bot)
+        decoded = load_bot.frame_decoder.report()
+        coalesced = load_bot.coalescer.report()
+        flood_limited = load_bot.flood_control.report()["limited"]
+        sent_at = dict(results["sent_at"], **inbox_sent_at)
+        latencies = sorted(
+            reddit.replied_at[message_id] - sent
+            for message_id, sent in sent_at.items()
+            if message_id in reddit.replied_at
+        )
+        load_bot.shutdown()
+
+    connection.send("stop")
+    fake_process.join(timeout=5.0)
+
+    print(
+        f"streams: {args.streams}, offered {args.rate:,.0f} frames/s and "
+        f"{args.inbox_rate:,.0f} inbox messages/s for {args.duration}s"
+    )
+    print(f"sockets connected in:  {connect_time:12.2f} s")
+    print(f"frames handled:        {handled:12,} of {results['frames']:,}")
+    print(f"messages/s:            {(handled + len(inbox_sent_at)) / elapsed:12,.0f}")
+    print(
+        f"decoder ({decoded['parser']}):        "
+        + ", ".join(
+            f"{stage} {count:,}" for stage, count in decoded.items() if stage != "parser"
+        )
+    )
+    print(f"replies:               {len(latencies):12,}")
+    print(f"coalesced replies:     {coalesced['suppressed']:12,}")
+    print(f"flood limited:         {flood_limited:12,}")
+    if latencies:
+        print(f"reply latency p50:     {percentile(latencies, 0.50) * 1000:12.2f} ms")
+        print(f"reply latency p99:     {percentile(latencies, 0.99) * 1000:12.2f} ms")
+    print(f"cpu:                   {cpu_used / elapsed * 100:12.1f} %")
+    print(f"peak rss:              {peak_rss_mib():12.1f} MiB")
+    if args.metrics:
+        print(f"metrics scrape:        {len(scrape.splitlines()):12,} lines")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the bot's hot paths.")
+    parser.add_argument(
+        "--config-dir", type=Path, default=Path(__file__).resolve().parent / "config"
+    )
+    parser.add_argument("--seed", type=int, default=17)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.set_defaults(func=benchmark_dispatch)
+    subparsers = parser.add_subparsers(title="benchmarks")
+
+    dispatch_parser = subparsers.add_parser(
+        "dispatch", help="Command dispatch against the old if/elif chain (the default)."
+    )
+    dispatch_parser.set_defaults(func=benchmark_dispatch)
+
+    load_parser = subparsers.add_parser(
+        "load", help="Drive a whole Bot against local fake Reddit, strapi and live sockets."
+    )
+    load_parser.add_argument("--streams", type=int, default=10)
+    load_parser.add_argument("--rate", type=float, default=500.0, help="Socket frames/s.")
+    load_parser.add_argument("--inbox-rate", type=float, default=5.0, help="Inbox messages/s.")
+    load_parser.add_argument(
+        "--noise", type=float, default=0.5, help="Non-comment frames sent per comment frame."
+    )
+    load_parser.add_argument("--duration", type=float, default=10.0)
+    load_parser.add_argument("--reply-rate", type=float, default=100000.0)
+    load_parser.add_argument("--connect-timeout", type=float, default=30.0)
+    load_parser.add_argument("--drain", type=float, default=5.0)
+    load_parser.add_argument("--metrics", action="store_true", help="Collect bot metrics too.")
+    load_parser.set_defaults(func=benchmark_load)
+    args = parser.parse_args()
+
+    # Replies and permission notices log at INFO, which would dominate the timings.
+    logging.getLogger("bot").setLevel(logging.CRITICAL)
+    args.func(args)
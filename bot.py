@@ -1,66 +1,513 @@
 from typing import Optional, Union, Dict, List, Tuple, Iterator, Generator
 from importlib import reload
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import asyncio
 import logging
+import signal
 import time
 import json
 
 import praw
 import prawcore
 import websocket
-import requests
-import discord_webhook
 
+from envelope import MessageEnvelope
+import announcements
+import browser_pool
+import cache
+import coalescer
+import discord_logging
+import flood_control
+import frame_decoder
+import metrics
+import multiplexer
+import outbound
+import persistence
+import post_scheduler
+import resolver
+import role_index
+import sharding
+import sqlite_store
+import stream_connection
 import utils
 import commands
 
+logger = logging.getLogger("bot")
+
 
 class Bot:
-    def __init__(self, script_dir: Path, config_dir: Path, config):
+    def __init__(
+        self,
+        script_dir: Path,
+        config_dir: Path,
+        config,
+        startup_timer: Optional[utils.StartupTimer] = None,
+        shard: Optional[sharding.ShardView] = None,
+        reddit: Optional[praw.Reddit] = None,
+    ):
+        self.startup_timer = startup_timer if startup_timer is not None else utils.StartupTimer()
+        self.shard = shard if shard is not None else sharding.ShardView()
+        self.first_socket_connected = False
         self.script_dir = script_dir
         self.config_dir = config_dir
 
         self.config = config
         self.secrets = utils.load_json(config_dir / "secrets.json")
-        self.users = utils.load_json(self.config_dir / "users.json")
         self.basic_commands = utils.load_json(self.config_dir / "basic_commands.json")
-        self.monitored_streams = utils.load_json(self.config_dir / "monitored_streams.json")
-        self.monitored_posts = utils.load_json(self.config_dir / "monitored_posts.json")
+
+        self.storage_config = utils.config_section(
+            self.config, "storage", {"backend": "json", "path": "state.db"}
+        )
+        if self.storage_config["backend"] == "sqlite":
+            logger.debug(f"Opening sqlite state store")
+            self.store = sqlite_store.SqliteStore(self.config_dir / self.storage_config["path"])
+            self.users = self.store.users
+            self.monitored_streams = self.store.monitored_streams
+            self.monitored_posts = self.store.monitored_posts
+            self.store_version = self.store.data_version()
+        else:
+            self.store = None
+            self.users = utils.load_json(self.config_dir / "users.json")
+            self.monitored_streams = utils.load_json(self.config_dir / "monitored_streams.json")
+            self.monitored_posts = utils.load_json(self.config_dir / "monitored_posts.json")
+
+        self.role_index = role_index.RoleIndex()
+        self.role_index.rebuild(self.users)
 
         self.commands = commands.Commands(self)
+        self.flood_control = flood_control.FloodControl(
+            **utils.config_section(
+                self.config,
+                "flood_control",
+                {
+                    "enabled": True,
+                    "rate": 0.2,
+                    "burst": 5,
+                    "command_rate": 0.1,
+                    "command_burst": 3,
+                    "max_authors": 4096,
+                },
+            )
+        )
+        self.startup_timer.mark("state load")
+
+        self.outbound = outbound.OutboundDispatcher(
+            # The load harness's fakes are thread safe, so its workers share them.
+            self.new_reddit if reddit is None else lambda: reddit,
+            **utils.config_section(
+                self.config,
+                "outbound",
+                {"rate": 1.0, "burst": 5, "workers": 2, "max_retries": 3},
+            ),
+        )
+        self.outbound.start()
+        # Lives on the bot rather than Commands, so windows survive a "!reload commands".
+        self.coalescer = coalescer.ReplyCoalescer(
+            self.outbound,
+            **utils.config_section(
+                self.config,
+                "reply_coalescing",
+                {
+                    "window": 10.0,
+                    "max_entries": 512,
+                    "mention_requesters": False,
+                    "max_mentions": 5,
+                },
+            ),
+        )
+
+        self.announcements_config = utils.config_section(
+            self.config,
+            "announcements",
+            {"max_retries": 3, "backoff": 2.0, "max_backoff": 60.0, "latency_window": 100},
+        )
+        self.announcement_dispatchers: List[announcements.AnnouncementDispatcher] = []
+        self.announcements = self.new_announcements(self.config["announcements_webhook"])
+
+        # Chrome itself is only launched once a stream needs the fallback.
+        self.browser_pool = browser_pool.BrowserPool(
+            self.script_dir / "other" / "chromedriver",
+            **utils.config_section(
+                self.config,
+                "browser_pool",
+                {"size": 1, "max_uses": 20, "max_park": 300.0, "idle_timeout": 600.0},
+            ),
+        )
+        self.startup_timer.mark("browser pool (deferred)")
 
-        if self.config["announcements_webhook"]["hooks"]:
-            self.webhook = discord_webhook.DiscordWebhook(
-                url=self.config["announcements_webhook"]["hooks"]
+        if reddit is None:
+            logger.debug(f"Initializing praw")
+            reddit = self.new_reddit()
+        # Passed in by benchmark.py's load harness, which drives the bot against fakes.
+        self.reddit = reddit
+        self.metadata = cache.MetadataCache(
+            self.reddit,
+            **utils.config_section(
+                self.config,
+                "metadata_cache",
+                {"live_comments_ttl": 300.0, "redditor_ttl": 3600.0, "max_entries": 1024},
+            ),
+        )
+        self.bot_name = self.metadata.bot_name()
+        self.frame_decoder = frame_decoder.FrameDecoder(self.bot_name, self.reddit)
+        self.startup_timer.mark("praw login")
+
+        self.monitored_subreddits = self.config["monitored_subreddits"]
+        self.watched_redditors = self.load_watched_redditors()
+
+        logger.debug(f"Adding submission/inbox streams")
+        # One feed over every monitored subreddit, however many redditors are watched.
+        self.submission_feed = self.reddit.subreddit("+".join(self.monitored_subreddits))
+        # Sharded, the feeds are read from wherever the leading shard last got to, so a shard taking
+        # over doesn't skip what came in before its first poll.
+        self.feed_skip_existing = self.shard.count == 1
+        self.feed_start = time.time()
+        self.open_feed_streams = {
+            self.submission_feed: self.submission_feed.stream.submissions(
+                pause_after=0, skip_existing=self.feed_skip_existing
+            ),
+            self.reddit.inbox: self.reddit.inbox.stream(
+                pause_after=0, skip_existing=self.feed_skip_existing
+            ),
+        }
+        self.startup_timer.mark("stream setup")
+
+        self.stream_connections: Dict[str, stream_connection.StreamConnection] = {}
+        self.reconnect_policy = stream_connection.ReconnectPolicy(
+            **utils.config_section(
+                self.config,
+                "reconnect",
+                {
+                    "base_delay": 1.0,
+                    "factor": 2.0,
+                    "max_delay": 30.0,
+                    "jitter": 0.5,
+                    "browser_after": 2,
+                    "browser_refresh_at": [6, 12, 20],
+                    "abandon_after": 30,
+                },
             )
-        else:
-            self.webhook = None
+        )
+        self.resolver = resolver.AddressResolver(
+            self.secrets["user_agent"],
+            **utils.config_section(
+                self.config,
+                "resolver",
+                {
+                    "workers": 4,
+                    "timeout": 10.0,
+                    "strapi_url": "https://strapi.reddit.com/videos/",
+                },
+            ),
+        )
 
-        logger.debug("Starting chrome webdriver")
-        self.webdriver = utils.launch_chrome(self.script_dir / "other" / "chromedriver")
-        self.webdriver_connected = None
+        self.run_mode = self.config.get("run_mode", "loop")
+        if self.run_mode == "sharded":
+            self.run_mode = utils.config_section(
+                self.config, "sharding", {"worker_run_mode": "loop"}
+            )["worker_run_mode"]
+        self.event_loop_config = utils.config_section(
+            self.config,
+            "event_loop",
+            {
+                "feed_interval": 2.0,
+                "posts_interval": 1.0,
+                "sockets_interval": 1.0,
+                "socket_poll_timeout": 0.5,
+            },
+        )
+        self.multiplexer = multiplexer.SocketMultiplexer()
+        self.post_polling_config = utils.config_section(
+            self.config,
+            "post_polling",
+            {
+                "fetch_limit": 100,
+                "max_seen": 500,
+                "grace": 60.0,
+                "min_interval": 5.0,
+                "max_interval": 600.0,
+                "backoff": 2.0,
+            },
+        )
+        # When each post was last fully covered by a listing pass or a tree fetch, kept in memory
+        # so a quiet post doesn't make every listing reach back to its last comment.
+        self.posts_scanned_until: Dict[str, float] = {}
+        self.post_scheduler = post_scheduler.PostScheduler(
+            min_interval=self.post_polling_config["min_interval"],
+            max_interval=self.post_polling_config["max_interval"],
+            backoff=self.post_polling_config["backoff"],
+        )
 
-        logger.debug(f"Initializing praw")
-        self.reddit = praw.Reddit(
+        self.persistence = persistence.WriteBehind(
+            **utils.config_section(self.config, "persistence", {"interval": 2.0})
+        )
+        if self.store is None:
+            self.persistence.register("users", self.config_dir / "users.json", lambda: self.users)
+            self.persistence.register(
+                "monitored_posts",
+                self.config_dir / "monitored_posts.json",
+                lambda: self.monitored_posts,
+            )
+            self.persistence.register(
+                "monitored_streams",
+                self.config_dir / "monitored_streams.json",
+                lambda: self.monitored_streams,
+            )
+        self.ensure_subscriber_roles()
+
+        self.metrics_config = utils.config_section(
+            self.config, "metrics", {"enabled": False, "host": "127.0.0.1", "port": 9108}
+        )
+        if self.metrics_config["enabled"]:
+            self.register_metrics()
+            # Every shard serves its own registry, one port up per shard.
+            metrics.REGISTRY.serve(
+                self.metrics_config["host"], self.metrics_config["port"] + self.shard.index
+            )
+
+        logger.info(f"Bot initialized in {self.startup_timer.report()}")
+
+    def new_reddit(self) -> praw.Reddit:
+        return praw.Reddit(
             username=self.secrets["user_name"],
             password=self.secrets["user_password"],
             client_id=self.secrets["app_id"],
             client_secret=self.secrets["app_secret"],
             user_agent=self.secrets["user_agent"],
+            requestor_class=metrics.CountingRequestor,
         )
-        self.bot_name = self.reddit.user.me().name
-        self.monitored_redditor = self.reddit.redditor(self.config["monitored_redditor"])
-        self.monitored_subreddits = self.config["monitored_subreddits"]
 
-        logger.debug(f"Adding submission/inbox streams")
-        self.open_feed_streams = {
-            self.monitored_redditor: self.monitored_redditor.stream.submissions(
-                pause_after=0, skip_existing=True
-            ),
-            self.reddit.inbox: self.reddit.inbox.stream(pause_after=0, skip_existing=True),
-        }
+    def new_announcements(
+        self, webhook_config: Dict
+    ) -> Optional[announcements.AnnouncementDispatcher]:
+        if not webhook_config.get("hooks"):
+            return None
+        dispatcher = announcements.AnnouncementDispatcher(
+            webhook_config["hooks"], webhook_config.get("mention", []), **self.announcements_config
+        )
+        self.announcement_dispatchers.append(dispatcher)
+        return dispatcher
+
+    def load_watched_redditors(self) -> Dict[str, Dict]:
+        # Entries are a redditor name, or a dict with their own subscriber role and webhook.
+        entries = list(self.config.get("monitored_redditors", []))
+        if self.config.get("monitored_redditor"):
+            entries.insert(0, self.config["monitored_redditor"])
 
-        self.websockets_dict = {}
+        watched_redditors = {}
+        for entry in entries:
+            if isinstance(entry, str):
+                entry = {"name": entry}
+            webhook_config = entry.get("announcements_webhook")
+            watched_redditors[entry["name"].lower()] = {
+                "name": entry["name"],
+                "subscriber_role": entry.get("subscriber_role", "subscribers"),
+                "announcements": (
+                    self.announcements
+                    if webhook_config is None
+                    else self.new_announcements(webhook_config)
+                ),
+                "image": (webhook_config or self.config["announcements_webhook"]).get("image"),
+            }
+        logger.info(f"Watching {len(watched_redditors)} redditors on {self.monitored_subreddits}")
+        return watched_redditors
+
+    def ensure_subscriber_roles(self):
+        for watched in self.watched_redditors.values():
+            role = watched["subscriber_role"]
+            if role in self.users:
+                continue
+            if self.store is not None:
+                self.users.add_role(role)
+            else:
+                self.users[role] = []
+                self.mark_dirty("users")
+
+    def register_metrics(self):
+        def outbound_samples():
+            report = self.outbound.report()
+            yield (
+                "bot_outbound_queue_depth",
+                "gauge",
+                "Queued outbound actions.",
+                {},
+                report["depth"],
+            )
+            for name in ("sent", "failed", "ratelimited"):
+                yield (
+                    f"bot_outbound_{name}_total",
+                    "counter",
+                    f"Outbound actions {name}.",
+                    {},
+                    report[name],
+                )
+
+        def socket_samples():
+            for post_id, stats in self.multiplexer.report().items():
+                labels = {"post_id": post_id}
+                yield (
+                    "bot_socket_frames_total",
+                    "counter",
+                    "Live comment frames received per stream.",
+                    labels,
+                    stats["frames"],
+                )
+                yield (
+                    "bot_socket_idle_seconds",
+                    "gauge",
+                    "Seconds since the stream's last frame.",
+                    labels,
+                    stats["idle"],
+                )
+
+        def stream_samples():
+            states = stream_connection.count_states(list(self.stream_connections.values()))
+            for state, count in states.items():
+                yield (
+                    "bot_streams",
+                    "gauge",
+                    "Live comment streams in each reconnect state.",
+                    {"state": state},
+                    count,
+                )
+
+        def frame_samples():
+            for stage, count in self.frame_decoder.report().items():
+                if stage == "parser":
+                    continue
+                yield (
+                    "bot_socket_frame_stages_total",
+                    "counter",
+                    "Live comment frames reaching each decoding stage.",
+                    {"stage": stage},
+                    count,
+                )
+
+        def cache_samples():
+            for name, report in self.metadata.report().items():
+                for result in ("hits", "misses"):
+                    yield (
+                        f"bot_cache_{result}_total",
+                        "counter",
+                        f"Metadata cache {result}.",
+                        {"cache": name},
+                        report[result],
+                    )
+
+        def component_samples():
+            resolver_report = self.resolver.report()
+            yield (
+                "bot_resolver_lookups_total",
+                "counter",
+                "Socket address lookups.",
+                {"result": "resolved"},
+                resolver_report["resolved"],
+            )
+            yield (
+                "bot_resolver_lookups_total",
+                "counter",
+                "Socket address lookups.",
+                {"result": "failed"},
+                resolver_report["failed"],
+            )
+            flood_report = self.flood_control.report()
+            yield (
+                "bot_flood_tracked_authors",
+                "gauge",
+                "Authors flood control is tracking.",
+                {},
+                flood_report["authors"],
+            )
+            coalescer_report = self.coalescer.report()
+            for result in ("sent", "suppressed"):
+                yield (
+                    "bot_coalesced_replies_total",
+                    "counter",
+                    "Basic command replies sent, or folded into an identical one.",
+                    {"result": result},
+                    coalescer_report[result],
+                )
+            persistence_report = self.persistence.report()
+            yield (
+                "bot_persistence_coalesced_total",
+                "counter",
+                "State saves folded into an already pending write.",
+                {},
+                persistence_report["coalesced"],
+            )
+            browser_report = self.browser_pool.report()
+            yield (
+                "bot_browsers_running",
+                "gauge",
+                "Chrome instances running.",
+                {},
+                browser_report["running"],
+            )
+            yield (
+                "bot_browser_launches_total",
+                "counter",
+                "Chrome launches.",
+                {},
+                browser_report["launches"],
+            )
+            yield (
+                "bot_monitored_streams",
+                "gauge",
+                "Streams being monitored.",
+                {},
+                len(self.monitored_streams["monitored"]),
+            )
+            yield (
+                "bot_monitored_posts",
+                "gauge",
+                "Posts being monitored.",
+                {},
+                len(self.monitored_posts),
+            )
+
+        def announcement_samples():
+            for number, dispatcher in enumerate(self.announcement_dispatchers):
+                for hook, report in dispatcher.report().items():
+                    labels = {"dispatcher": str(number), "hook": hook}
+                    for name in ("sent", "failed", "retries"):
+                        yield (
+                            f"bot_announcements_{name}_total",
+                            "counter",
+                            f"Announcement deliveries {name}.",
+                            labels,
+                            report[name],
+                        )
+
+        metrics.REGISTRY.collect("outbound", outbound_samples)
+        metrics.REGISTRY.collect("sockets", socket_samples)
+        metrics.REGISTRY.collect("streams", stream_samples)
+        metrics.REGISTRY.collect("frames", frame_samples)
+        metrics.REGISTRY.collect("cache", cache_samples)
+        metrics.REGISTRY.collect("components", component_samples)
+        metrics.REGISTRY.collect("announcements", announcement_samples)
+
+    def sync_store(self):
+        # data_version only moves when another connection commits, i.e. another shard.
+        if self.store is None:
+            return
+        store_version = self.store.data_version()
+        if store_version != self.store_version:
+            self.store_version = store_version
+            self.role_index.rebuild(self.users)
+
+    def add_to_role(self, role: str, user_name: str):
+        self.users[role].append(user_name)
+        self.role_index.add(user_name, role)
+
+    def remove_from_role(self, role: str, user_name: str):
+        self.users[role].remove(user_name)
+        self.role_index.remove(user_name, role)
+
+    def mark_dirty(self, update: str):
+        # The sqlite store writes each row as it changes, only the JSON files need saving.
+        if self.store is None:
+            self.persistence.mark_dirty(update)
 
     def check_update(self, update: Optional[str], mode=Optional[str]) -> None:
         if update == None or mode == None:
@@ -69,329 +516,643 @@ class Bot:
         if mode == "load":
             logger.info(f"Loading {update}")
             if update == "commands":
-                basic_commands = utils.load_json(self.config_dir / "basic_commands.json")
+                # Commands reads these when it's built, so edits to the file load along with it.
+                self.basic_commands = utils.load_json(self.config_dir / "basic_commands.json")
                 global commands
                 commands = reload(commands)
                 self.commands = commands.Commands(self)
+            elif self.store is not None:
+                logger.info(f"{update} is read from the sqlite store, nothing to load.")
             elif update == "users":
                 self.users = utils.load_json(self.config_dir / "users.json")
+                self.role_index.rebuild(self.users)
+                self.persistence.discard(update)
+                self.ensure_subscriber_roles()
             elif update == "monitored_posts":
                 self.monitored_posts = utils.load_json(self.config_dir / "monitored_posts.json")
+                self.persistence.discard(update)
             elif update == "monitored_streams":
                 self.monitored_streams = utils.load_json(self.config_dir / "monitored_streams.json")
+                self.persistence.discard(update)
         elif mode == "save":
             logger.info(f"Saving {update}")
-            if update == "users":
-                utils.save_json(self.config_dir / "users.json", self.users)
-            elif update == "monitored_posts":
-                utils.save_json(self.config_dir / "monitored_posts.json", self.monitored_posts)
-            elif update == "monitored_streams":
-                utils.save_json(self.config_dir / "monitored_streams.json", self.monitored_streams)
+            if update in ("users", "monitored_posts", "monitored_streams"):
+                self.mark_dirty(update)
 
-    def check_redditor(self, stream_source: praw.models.Redditor, submission_stream: Generator):
+    @metrics.timed(metrics.PHASE_SECONDS, "check_submissions")
+    def check_submissions(self, submission_stream: Generator):
         for submission in submission_stream:
             if submission is None:
                 break
-            if not submission.subreddit in self.monitored_subreddits:
+            if submission.author is None:
+                continue
+            watched = self.watched_redditors.get(submission.author.name.lower())
+            if watched is None:
                 continue
-
             if submission.allow_live_comments:
-                self.monitored_streams["monitored"][submission.id] = None
+                self.announce_live(watched, submission)
 
-                utils.save_json(self.config_dir / "monitored_streams.json", self.monitored_streams)
-                redditor_name = str(stream_source)
-                logger.info(
-                    f"{redditor_name} has gone live on {submission.subreddit} at ({submission.shortlink}) notifing {len(self.users['subscribers'])} subscribers, and posting to discord.",
-                )
+    def announce_live(self, watched: Dict, submission: praw.models.Submission):
+        self.monitored_streams["monitored"][submission.id] = None
+        self.prewarm_stream(submission)
 
-                if self.webhook is not None:
-                    utils.webhook_post(
-                        webhook=self.webhook,
-                        plain_text_message=", ".join(
-                            self.config["announcements_webhook"]["mention"]
-                        ),
-                        embeds=[
-                            utils.discord_embed_builder(
-                                embed_title=f"u/{redditor_name} has gone live on {submission.subreddit}!",
-                                embed_description=f"[{submission.title}]({submission.shortlink})",
-                                embed_image=self.config["announcements_webhook"]["image"],
-                                author=redditor_name,
-                                author_url=f"https://www.reddit.com/u/{redditor_name}",
-                            )
-                        ],
-                    )
+        self.mark_dirty("monitored_streams")
+        redditor_name = watched["name"]
+        subscribers = list(self.users[watched["subscriber_role"]])
+        logger.info(
+            f"{redditor_name} has gone live on {submission.subreddit} at ({submission.shortlink}) notifing {len(subscribers)} subscribers, and posting to discord.",
+        )
 
-                for subscriber in self.users["subscribers"]:
-                    self.reddit.redditor(subscriber).message(
-                        subject=f"Hi {subscriber}, u/{redditor_name} is live on {submission.subreddit}!",
-                        message=f"[{submission.title}]({submission.shortlink})",
+        if watched["announcements"] is not None:
+            watched["announcements"].announce(
+                f"{redditor_name} live on {submission.id}",
+                [
+                    utils.discord_embed_builder(
+                        embed_title=f"u/{redditor_name} has gone live on {submission.subreddit}!",
+                        embed_description=f"[{submission.title}]({submission.shortlink})",
+                        embed_image=watched["image"],
+                        author=redditor_name,
+                        author_url=f"https://www.reddit.com/u/{redditor_name}",
                     )
-                    logger.debug(f"Sent subscriber u/{subscriber} gone live message.")
+                ],
+            )
 
+        for subscriber in subscribers:
+            self.outbound.direct_message(
+                subscriber,
+                subject=f"Hi {subscriber}, u/{redditor_name} is live on {submission.subreddit}!",
+                message=f"[{submission.title}]({submission.shortlink})",
+            )
+            logger.debug(f"Queued subscriber u/{subscriber} gone live message.")
+
+    @metrics.timed(metrics.PHASE_SECONDS, "check_inbox")
     def check_inbox(self, inbox_stream: Generator):
         for message in inbox_stream:
             if message is None:
                 return
             update, mode = self.commands.check_message(
-                {
-                    "message": message,
-                    "body": message.body,
-                    "author": message.author.name,
-                    "context": "inbox",
-                    "submission_id": None,
-                }
+                MessageEnvelope(message.body, message.author.name, "inbox", None, message=message)
             )
             self.check_update(update, mode)
 
+    def new_post_cursor(
+        self,
+        submission: praw.models.Submission,
+        last_created: Optional[float] = None,
+        seen: Optional[List[str]] = None,
+    ) -> Dict:
+        return {
+            "subreddit": submission.subreddit.display_name,
+            "last_created": time.time() if last_created is None else last_created,
+            "seen": [] if seen is None else seen[-self.post_polling_config["max_seen"] :],
+        }
+
+    def migrate_post_cursor(self, post_id: str) -> List[praw.models.Comment]:
+        # Older monitored_posts.json files store a comment count, which needs one full fetch to
+        # turn into a cursor. The comments past the old count are returned as still unprocessed.
+        comment_count = self.monitored_posts[post_id]
+        submission = self.reddit.submission(post_id)
+        comment_list = self.fetch_comment_tree(submission)
+        comment_list.sort(key=lambda comment: comment.created_utc)
+
+        processed = comment_list[:comment_count]
+        last_created = processed[-1].created_utc if processed else 0.0
+        self.monitored_posts[post_id] = self.new_post_cursor(
+            submission, last_created, [comment.id for comment in processed]
+        )
+        self.mark_dirty("monitored_posts")
+        logger.info(f"Migrated post {post_id} from comment count to cursor.")
+        return comment_list[comment_count:]
+
+    @staticmethod
+    def fetch_comment_tree(submission: praw.models.Submission) -> List[praw.models.Comment]:
+        # "load more comments" stubs have no created_utc, expanding them costs a request each.
+        return [
+            comment
+            for comment in submission.comments.list()
+            if not isinstance(comment, praw.models.MoreComments)
+        ]
+
+    @metrics.timed(metrics.PHASE_SECONDS, "check_posts")
     def check_posts(self):
-        for post_id, comment_count in self.monitored_posts.items():
-            logger.debug(f"Checking post {post_id}")
-            comment_list = self.reddit.submission(post_id).comments.list()
-            comment_list.sort(key=lambda comment: comment.created)
-
-            new_post_messages = 0
-            for comment in comment_list[comment_count:]:
-                if not post_id in self.monitored_posts:
-                    logger.debug(f"{post_id} unmonitored mid-loop breaking loop.")
+        now = time.time()
+        due_posts = self.post_scheduler.due(self.monitored_posts.keys(), now)
+
+        pending_comments = {}
+        posts_by_subreddit = {}
+        for post_id in list(self.posts_scanned_until.keys()):
+            if post_id not in self.monitored_posts:
+                self.posts_scanned_until.pop(post_id)
+        for post_id in list(self.monitored_posts.keys()):
+            if isinstance(self.monitored_posts[post_id], int):
+                pending_comments[post_id] = self.migrate_post_cursor(post_id)
+                continue
+            subreddit_name = self.monitored_posts[post_id]["subreddit"]
+            posts_by_subreddit.setdefault(subreddit_name, []).append(post_id)
+
+        fetch_limit = self.post_polling_config["fetch_limit"]
+        grace = self.post_polling_config["grace"]
+        for subreddit_name, post_ids in posts_by_subreddit.items():
+            # One listing covers every post in the subreddit, so quiet posts sharing it with a
+            # due post get checked for free.
+            if not due_posts.intersection(post_ids):
+                continue
+
+            logger.debug(f"Checking posts {post_ids} in r/{subreddit_name}")
+            link_ids = {f"t3_{post_id}": post_id for post_id in post_ids}
+            # Posts not scanned since startup fall back to their newest comment.
+            oldest_scan = min(
+                self.posts_scanned_until.get(post_id, self.monitored_posts[post_id]["last_created"])
+                for post_id in post_ids
+            )
+            subreddit_comments = {post_id: [] for post_id in post_ids}
+
+            # The subreddit listing is newest first, so stop once it passes the oldest scan.
+            fetched = 0
+            reached_cursor = False
+            scanned_at = time.time()
+            for comment in self.reddit.subreddit(subreddit_name).comments(limit=fetch_limit):
+                fetched += 1
+                if comment.created_utc < oldest_scan - grace:
+                    reached_cursor = True
                     break
-                author = comment.author.name
-                if author == self.bot_name:
-                    continue
+                post_id = link_ids.get(comment.link_id)
+                if post_id is not None:
+                    subreddit_comments[post_id].append(comment)
 
-                update, mode = self.commands.check_message(
-                    {
-                        "message": comment,
-                        "body": comment.body,
-                        "author": author,
-                        "context": "post",
-                        "submission_id": comment.submission.id,
-                    }
-                )
-                self.check_update(update, mode)
-                new_post_messages += 1
+            if not reached_cursor and fetched >= fetch_limit:
+                # More new comments than one listing page holds, fall back to the full trees.
+                # Posts that weren't due wait for their turn rather than skip past the gap.
+                for post_id in due_posts.intersection(post_ids):
+                    logger.debug(f"Listing for r/{subreddit_name} overflowed, fetching {post_id}")
+                    pending_comments[post_id] = self.fetch_comment_tree(
+                        self.reddit.submission(post_id)
+                    )
+                    self.posts_scanned_until[post_id] = scanned_at
+            else:
+                pending_comments.update(subreddit_comments)
+                for post_id in post_ids:
+                    self.posts_scanned_until[post_id] = scanned_at
+
+        for post_id, comments in pending_comments.items():
+            new_comments = self.process_post_comments(post_id, comments)
+            self.post_scheduler.record(post_id, new_comments, now)
+
+    def process_post_comments(self, post_id: str, comments: List[praw.models.Comment]) -> int:
+        if post_id not in self.monitored_posts:
+            return 0
+        cursor = self.monitored_posts[post_id]
+        seen = set(cursor["seen"])
+        threshold = cursor["last_created"] - self.post_polling_config["grace"]
+
+        new_comments = [
+            comment
+            for comment in comments
+            if comment.created_utc >= threshold and comment.id not in seen
+        ]
+        if not new_comments:
+            return 0
+        new_comments.sort(key=lambda comment: comment.created_utc)
+
+        seen_ids = list(cursor["seen"])
+        last_created = cursor["last_created"]
+        for comment in new_comments:
+            if not post_id in self.monitored_posts:
+                logger.debug(f"{post_id} unmonitored mid-loop breaking loop.")
+                return len(new_comments)
+            seen_ids.append(comment.id)
+            last_created = max(last_created, comment.created_utc)
+
+            if comment.author is None:
+                continue
+            author = comment.author.name
+            if author == self.bot_name:
+                continue
+
+            update, mode = self.commands.check_message(
+                MessageEnvelope(comment.body, author, "post", post_id, message=comment)
+            )
+            self.check_update(update, mode)
 
-            if new_post_messages and post_id in self.monitored_posts:
-                self.monitored_posts[post_id] = len(comment_list)
-                utils.save_json(self.config_dir / "monitored_posts.json", self.monitored_posts)
+        if post_id in self.monitored_posts:
+            self.monitored_posts[post_id] = {
+                "subreddit": cursor["subreddit"],
+                "last_created": last_created,
+                "seen": seen_ids[-self.post_polling_config["max_seen"] :],
+            }
+            self.mark_dirty("monitored_posts")
+        return len(new_comments)
 
     def remove_old_sockets(self):
-        for post_id in list(self.websockets_dict.keys()):
-            if post_id not in self.monitored_streams["monitored"]:
-                if self.websockets_dict[post_id]["socket"] is not None:
-                    self.websockets_dict[post_id]["socket"].close()
-                self.websockets_dict.pop(post_id)
+        for post_id in list(self.stream_connections.keys()):
+            if post_id not in self.monitored_streams["monitored"] or not self.shard.owns(post_id):
+                self.multiplexer.unregister(post_id)
+                self.browser_pool.release(post_id)
+                self.stream_connections.pop(post_id).close()
                 logger.info(f"Socket for {post_id} disconnected.")
 
-    def add_new_sockets(self):
-        def get_websocket_address(post_id: str) -> bool:
-            logger.debug(f"Attempting to retrieving new socket address for {post_id}")
-            submission = self.reddit.submission(post_id)
-            response = requests.get(
-                f"https://strapi.reddit.com/videos/{submission.fullname}",
-                headers={
-                    "user-agent": self.secrets["user_agent"],
-                    "authorization": f"Bearer {self.reddit._authorized_core._authorizer.access_token}",
-                    "Sec-Fetch-Mode": "no-cors",
-                },
-            )
-            if not response.ok:
-                return False
+    def prewarm_stream(self, submission: praw.models.Submission):
+        # Resolved and connected on the resolver's workers while the announcements go out, early
+        # chat is when viewers use commands the most.
+        post_id = submission.id
+        if post_id in self.stream_connections or not self.shard.owns(post_id):
+            return
+        connection = self.stream_connections[post_id] = stream_connection.StreamConnection(
+            post_id, self.reconnect_policy
+        )
+        connection.went_live_at = submission.created_utc
+        connection.detected_at = time.time()
+        self.request_websocket_address(connection, connect=True)
+
+    def request_websocket_address(
+        self, connection: stream_connection.StreamConnection, connect: bool = False
+    ):
+        logger.debug(f"Attempting to retrieving new socket address for {connection.post_id}")
+        connection.transition(stream_connection.RESOLVING, "looking up socket address")
+        self.resolver.submit(
+            connection.post_id,
+            self.metadata.fullname(connection.post_id),
+            self.reddit._authorized_core._authorizer.access_token,
+            connect,
+        )
 
-            websocket_address = response.json()["data"]["post"]["liveCommentsWebsocket"]
-            if self.monitored_streams["monitored"][post_id] != websocket_address:
-                self.monitored_streams["monitored"][post_id] = websocket_address
-                return True
+    def handle_websocket_address(
+        self,
+        post_id: str,
+        websocket_address: Optional[str],
+        this_socket: Optional[websocket.WebSocket] = None,
+        error: Optional[Exception] = None,
+    ) -> bool:
+        connection = self.stream_connections.get(post_id)
+        if (
+            connection is None
+            or post_id not in self.monitored_streams["monitored"]
+            or connection.state == stream_connection.LIVE
+        ):
+            if this_socket is not None:
+                this_socket.close()
+            return False
+
+        if connection.state != stream_connection.RESOLVING:
+            # Only a connect to the saved address is in flight outside of resolving.
+            return self.stream_dialled(connection, websocket_address, this_socket, error)
+        if websocket_address is None:
+            return self.stream_failed(connection, "could not obtain socket address", stale=True)
 
-            logger.debug(
-                f"Retrieved new socket address for {post_id}: {websocket_address} but is the same as saved.",
+        # The same address coming back means it's still current, so it's tried again rather than
+        # counted as another failure.
+        save_streams = self.monitored_streams["monitored"][post_id] != websocket_address
+        if save_streams:
+            self.monitored_streams["monitored"][post_id] = websocket_address
+            logger.info(f"Retrieved new socket address for {post_id}: {websocket_address}")
+            self.browser_pool.release(post_id)
+        if this_socket is not None:
+            self.stream_connected(connection, websocket_address, this_socket)
+        else:
+            connection.retry_at = 0.0
+            connection.transition(
+                stream_connection.CONNECTING,
+                "new socket address" if save_streams else "saved socket address confirmed",
             )
+        return save_streams
+
+    def stream_failed(
+        self, connection: stream_connection.StreamConnection, reason: str, stale: bool = False
+    ) -> bool:
+        # True when the stream was given up on, monitored_streams changed and needs saving.
+        post_id = connection.post_id
+        browser_step = connection.failed(reason, time.monotonic(), stale)
+        if browser_step == "load":
+            self.browser_pool.load(post_id)
+        elif browser_step == "refresh":
+            self.browser_pool.refresh(post_id)
+
+        if connection.state != stream_connection.ABANDONED:
+            return False
+        self.monitored_streams["unmonitored"][post_id] = self.monitored_streams["monitored"].pop(
+            post_id
+        )
+        self.browser_pool.release(post_id)
+        logger.error(
+            f"Could not connect to the socket for {post_id} after {connection.failures} tries. Unmonitoring stream."
+        )
+        return True
+
+    def connect_stream(
+        self, connection: stream_connection.StreamConnection, websocket_address: str
+    ):
+        # Connected on the resolver's workers, the result comes back through resolver.poll().
+        self.resolver.connect(connection.post_id, websocket_address)
+
+    def stream_dialled(
+        self,
+        connection: stream_connection.StreamConnection,
+        websocket_address: str,
+        this_socket: Optional[websocket.WebSocket],
+        error: Optional[Exception],
+    ) -> bool:
+        if this_socket is not None:
+            self.stream_connected(connection, websocket_address, this_socket)
             return False
+        if isinstance(error, websocket.WebSocketBadStatusException):
+            # A 4xx is Reddit refusing this address, anything else is worth retrying as is.
+            return self.stream_failed(
+                connection,
+                f"could not connect, error {error.status_code}",
+                stale=400 <= error.status_code < 500,
+            )
+        return self.stream_failed(connection, f"could not connect, {error}")
+
+    def stream_connected(
+        self,
+        connection: stream_connection.StreamConnection,
+        websocket_address: str,
+        this_socket: websocket.WebSocket,
+    ):
+        self.multiplexer.register(connection.post_id, this_socket)
+        self.browser_pool.release(connection.post_id)
+        connection.connected(this_socket)
+        logger.info(f"Socket for {connection.post_id} connected at {websocket_address}")
+        if not self.first_socket_connected:
+            self.first_socket_connected = True
+            logger.info(
+                f"First live chat socket connected {time.perf_counter() - self.startup_timer.started:.2f}s after start."
+            )
 
+    def record_first_frame(self, connection: stream_connection.StreamConnection):
+        first_frame = self.multiplexer.first_frame(connection.post_id)
+        if first_frame is None:
+            return
+        connection.first_frame_at = first_frame
+        since_live = first_frame - connection.went_live_at
+        since_detected = first_frame - connection.detected_at
+        metrics.FIRST_FRAME_SECONDS.observe(since_live, "submission")
+        metrics.FIRST_FRAME_SECONDS.observe(since_detected, "detection")
+        logger.info(
+            f"First frame from {connection.post_id} {since_live:.2f}s after it went live, {since_detected:.2f}s after it was seen."
+        )
+
+    @metrics.timed(metrics.PHASE_SECONDS, "add_new_sockets")
+    def add_new_sockets(self):
+        # Lookups run on the resolver's workers, this only collects whatever finished since the
+        # last pass, so connected sockets keep being served while lookups are in flight.
         save_streams = False
-        for post_id, websocket_address in self.monitored_streams["monitored"].items():
-            if post_id not in self.websockets_dict:
-                self.websockets_dict[post_id] = {
-                    "socket": None,
-                    "timeout_length": 15,
-                    "last_tried": time.time(),
-                    "retry_count": 0,
-                }
+        for post_id, websocket_address, this_socket, error in self.resolver.poll():
+            if self.handle_websocket_address(post_id, websocket_address, this_socket, error):
+                save_streams = True
+
+        now = time.monotonic()
+        for post_id, websocket_address in list(self.monitored_streams["monitored"].items()):
+            if not self.shard.owns(post_id):
+                continue
+            connection = self.stream_connections.get(post_id)
+            if connection is None:
+                connection = self.stream_connections[post_id] = stream_connection.StreamConnection(
+                    post_id,
+                    self.reconnect_policy,
+                    (
+                        stream_connection.RESOLVING
+                        if websocket_address is None
+                        else stream_connection.CONNECTING
+                    ),
+                )
                 if websocket_address is None:
-                    success = get_websocket_address(post_id)
-                    if success:
-                        logger.info(
-                            f"Retrieved new socket address for {post_id}: {websocket_address}"
-                        )
-                        save_streams = True
-                    else:
-                        logger.warning(f"Failed retrieving new socket address. for {post_id}")
-                        continue
-            else:
-                this_websocket = self.websockets_dict[post_id]
-
-                if this_websocket["socket"] is None:
-                    if self.webdriver_connected is None or self.webdriver_connected == post_id:
-                        if (
-                            this_websocket["last_tried"] + this_websocket["timeout_length"]
-                            < time.time()
-                        ):
-                            success = get_websocket_address(post_id)
-                            if not success:
-                                this_websocket["last_tried"] = time.time()
-                                this_websocket["retry_count"] += 1
-                                if this_websocket["retry_count"] == 2:
-                                    logger.warning(
-                                        f"Could not obtain new socket address for {post_id} after {this_websocket['retry_count']} retries. Timing out for {this_websocket['timeout_length']} seconds. Loading webdriver to page."
-                                    )
-                                    self.webdriver.get(f"http://redd.it/{post_id}")
-                                    self.webdriver_connected = post_id
-                                    logger.info(f"Webdriver loaded to {post_id}")
-                                elif this_websocket["retry_count"] in (6, 12, 20):
-                                    logger.warning(
-                                        f"Could not obtain new socket address for {post_id} after {this_websocket['retry_count']} retries. Timing out for {this_websocket['timeout_length']} seconds. Refreshing page."
-                                    )
-                                    self.webdriver.refresh()
-                                    logger.info("Webdriver reloaded.")
-                                elif this_websocket["retry_count"] == 30:
-                                    self.monitored_streams["unmonitored"][
-                                        post_id
-                                    ] = self.monitored_streams["monitored"][post_id]
-                                    self.monitored_streams["monitored"].pop(post_id)
-                                    self.webdriver.get("https://www.google.com")
-                                    self.webdriver_connected = None
-                                    logger.error(
-                                        f"Could not obtain new socket address for {post_id} after {this_websocket['retry_count']} retries. Unmonitoring stream."
-                                    )
-                                else:
-                                    logger.warning(
-                                        f"Could not obtain new socket address for {post_id} after {this_websocket['retry_count']} retries. Timing out for {this_websocket['timeout_length']} seconds."
-                                    )
-                                continue
-                            if self.webdriver_connected == post_id:
-                                self.webdriver.get("https://www.google.com")
-                                self.webdriver_connected = None
-                            save_streams = True
-                        else:
-                            continue
-                    else:
-                        continue
-
-            websocket_address = self.monitored_streams["monitored"][post_id]
-            try:
-                this_websocket = self.websockets_dict[post_id]
-                if (this_websocket["socket"] is not None) or websocket_address is None:
+                    self.request_websocket_address(connection)
                     continue
 
-                this_websocket["socket"] = websocket.create_connection(websocket_address)
-                this_websocket["socket"].settimeout(0.1)
-                this_websocket["timeout_length"] = 15
-                this_websocket["last_tried"] = time.time()
-                this_websocket["retry_count"] = 0
+            if connection.state == stream_connection.LIVE and not connection.socket.connected:
+                # Caught here too, a socket can go down without the multiplexer reading from it.
+                self.multiplexer.unregister(post_id)
+                connection.dropped("socket no longer connected")
+            if (
+                connection.state == stream_connection.LIVE
+                and connection.went_live_at is not None
+                and connection.first_frame_at is None
+            ):
+                self.record_first_frame(connection)
 
-                logger.info(f"Socket for {post_id} connected at {websocket_address}")
+            if not connection.due(now) or self.resolver.busy(post_id):
+                continue
+            if connection.state == stream_connection.CONNECTING or (
+                websocket_address is not None and not connection.needs_address()
+            ):
+                self.connect_stream(connection, websocket_address)
+            else:
+                self.request_websocket_address(connection)
 
-            except websocket.WebSocketBadStatusException as bad_status:
-                this_websocket["socket"] = None
-                this_websocket["timeout_length"] = 30
-                this_websocket["last_tried"] = time.time()
-                this_websocket["retry_count"] = 0
+        if save_streams:
+            self.mark_dirty("monitored_streams")
 
-                logger.warning(
-                    f"Socket for {post_id} at {websocket_address} could not connect, error {bad_status.status_code}. Timing out for {this_websocket['timeout_length']} seconds."
-                )
+    @metrics.timed(metrics.PHASE_SECONDS, "dispatch_socket_frames")
+    def dispatch_socket_frames(self, envelopes: List[MessageEnvelope], closed: List[str]):
+        for post_id in closed:
+            connection = self.stream_connections.get(post_id)
+            if connection is None or connection.state != stream_connection.LIVE:
+                continue
+            connection.dropped("socket closed")
+            # Straight back to the address it was using, rather than waiting for add_new_sockets.
+            websocket_address = self.monitored_streams["monitored"].get(post_id)
+            if websocket_address is not None:
+                self.connect_stream(connection, websocket_address)
 
-            self.websockets_dict[post_id] = this_websocket
+        for new_message in envelopes:
+            try:
+                update, mode = self.commands.check_message(new_message)
+                self.check_update(update, mode)
+            except praw.exceptions.RedditAPIException:
+                raise
+            except Exception as e:
+                logger.error(f"Socket for post {new_message.submission_id} excepted {e}")
 
-        if save_streams:
-            utils.save_json(self.config_dir / "monitored_streams.json", self.monitored_streams)
+    @metrics.timed(metrics.PHASE_SECONDS, "poll_wait")
+    def wait_sockets(self, timeout: float = 0.0) -> List[str]:
+        return self.multiplexer.wait(timeout)
 
-    def check_sockets(self):
-        for post_id, this_websocket in self.websockets_dict.items():
-            if this_websocket["socket"] is None:
-                continue
+    def read_sockets(self, ready: List[str]) -> Tuple[List[MessageEnvelope], List[str]]:
+        # Decoding happens here, on the socket thread in async mode, so the state thread only
+        # ever sees frames that are commands.
+        frames, closed = self.multiplexer.read(ready)
+        return self.frame_decoder.decode(frames), closed
 
-            logger.debug(f"Checking socket for {post_id}")
-            if not this_websocket["socket"].connected:
-                this_websocket["socket"] = None
-                continue
+    def poll_sockets(self, timeout: float = 0.0) -> Tuple[List[MessageEnvelope], List[str]]:
+        return self.read_sockets(self.wait_sockets(timeout))
 
-            socket_empty = False
-            while not socket_empty:
-                try:
-                    socket_json = this_websocket["socket"].recv()
-                    socket_data = json.loads(socket_json)
-                    if not socket_data["type"] == "new_comment":
-                        continue
-
-                    author = socket_data["payload"]["author"]
-
-                    if author == self.reddit.user.me().name:
-                        continue
-
-                    update, mode = self.commands.check_message(
-                        {
-                            "message": self.reddit.comment(socket_data["payload"]["_id36"]),
-                            "body": socket_data["payload"]["body"],
-                            "author": author,
-                            "context": "stream",
-                            "submission_id": socket_data["payload"]["link_id"].split("_")[1],
-                        }
-                    )
-                    self.check_update(update, mode)
+    def check_sockets(self, timeout: float = 0.0):
+        self.handle_ready_sockets(self.wait_sockets(timeout))
+
+    @metrics.timed(metrics.PHASE_SECONDS, "check_sockets")
+    def handle_ready_sockets(self, ready: List[str]):
+        # Timed without the wait, which is its own poll_wait phase.
+        self.dispatch_socket_frames(*self.read_sockets(ready))
 
-                except websocket.WebSocketTimeoutException:
-                    logger.debug(f"Socket at {post_id} timed out.")
-                    socket_empty = True
-                except Exception as e:
-                    # TODO figure out how exactly reddit disconnects the socket
-                    logger.error(f"Socket for post {post_id} excepted {e}")
-                    socket_empty = True
+    def check_feed(self, stream_source):
+        open_stream = self.open_feed_streams[stream_source]
+        logger.debug(f"Checking praw stream {stream_source}")
+        if type(stream_source) == praw.models.Subreddit:
+            if not self.feed_skip_existing:
+                open_stream = self.unhandled_feed_items("submissions", open_stream)
+            try:
+                self.check_submissions(open_stream)
+            except prawcore.exceptions.ServerError as e:
+                self.open_feed_streams[stream_source] = stream_source.stream.submissions(
+                    pause_after=0, skip_existing=self.feed_skip_existing
+                )
+                logger.error(
+                    f"Reddit feed stream for {stream_source} excepted {e}, skipping and reinitializing the generator."
+                )
+        elif type(stream_source) == praw.models.inbox.Inbox:
+            if not self.feed_skip_existing:
+                open_stream = self.unhandled_feed_items("inbox", open_stream)
+            try:
+                self.check_inbox(open_stream)
+            except prawcore.exceptions.ServerError as e:
+                self.open_feed_streams[stream_source] = stream_source.stream(
+                    pause_after=0, skip_existing=self.feed_skip_existing
+                )
+                logger.error(
+                    f"Reddit feed stream for {stream_source} excepted {e}, skipping and reinitializing the generator."
+                )
+
+    def unhandled_feed_items(self, feed: str, open_stream: Generator) -> Generator:
+        # Whatever another shard handled while it led is skipped, as is anything from before the
+        # first shard started. Not yield from, that would close the feed's own generator too.
+        position = self.store.feed_position(feed)
+        last_created, last_fullname = position if position is not None else (self.feed_start, "")
+        for item in open_stream:
+            if item is not None and (
+                item.created_utc < last_created or item.fullname == last_fullname
+            ):
+                continue
+            yield item
+            if item is not None and item.created_utc >= last_created:
+                last_created, last_fullname = item.created_utc, item.fullname
+                self.store.set_feed_position(feed, last_created, last_fullname)
 
     def run(self):
         logger.info(f"Starting bot loop")
         while True:
-            for stream_source, open_stream in self.open_feed_streams.items():
-                logger.debug(f"Checking praw stream {stream_source}")
-                if type(stream_source) == praw.models.Redditor:
-                    try:
-                        self.check_redditor(stream_source, open_stream)
-                    except prawcore.exceptions.ServerError as e:
-                        open_stream = stream_source.stream.submissions(
-                            pause_after=0, skip_existing=True
-                        )
-                        logger.error(
-                            f"Reddit feed stream for {stream_source} excepted {e}, skipping and reinitializing the generator."
-                        )
-                elif type(stream_source) == praw.models.inbox.Inbox:
-                    try:
-                        self.check_inbox(open_stream)
-                    except prawcore.exceptions.ServerError as e:
-                        open_stream = stream_source.stream(pause_after=0, skip_existing=True)
-                        logger.error(
-                            f"Reddit feed stream for {stream_source} excepted {e}, skipping and reinitializing the generator."
-                        )
+            # Waited out before the pass is timed, so the loop time is work rather than idling.
+            ready = self.wait_sockets(self.event_loop_config["socket_poll_timeout"])
+            with metrics.LOOP_SECONDS.time():
+                self.sync_store()
+                if self.shard.is_leader():
+                    for stream_source in list(self.open_feed_streams.keys()):
+                        self.check_feed(stream_source)
+
+                    self.check_posts()
+
+                self.add_new_sockets()
+                self.remove_old_sockets()
+                self.handle_ready_sockets(ready)
+                self.coalescer.flush_due()
+
+                self.persistence.flush_due()
+
+    def run_async(self):
+        logger.info(f"Starting bot event loop")
+        asyncio.run(self.main_async())
+
+    async def main_async(self):
+        # All praw calls and state mutations run on the single state thread, so handlers never
+        # race each other. The socket thread blocks in the multiplexer and only wakes on I/O.
+        self.state_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot-state")
+        self.socket_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot-socket")
+        # Finished address lookups wake sockets_task early, a pre-warmed socket shouldn't sit
+        # unregistered for the rest of sockets_interval.
+        loop = asyncio.get_running_loop()
+        self.sockets_wake = asyncio.Event()
+        self.resolver.on_done = lambda: loop.call_soon_threadsafe(self.sockets_wake.set)
+
+        tasks = [
+            asyncio.create_task(self.feed_task(stream_source))
+            for stream_source in list(self.open_feed_streams.keys())
+        ]
+        tasks.append(asyncio.create_task(self.posts_task()))
+        tasks.append(asyncio.create_task(self.sockets_task()))
+        tasks.append(asyncio.create_task(self.socket_pump_task()))
+        tasks.append(asyncio.create_task(self.persistence_task()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.resolver.on_done = None
+            for task in tasks:
+                task.cancel()
+            # A handler still running on the state thread finishes before shutdown() flushes and
+            # closes everything it might be using.
+            self.state_executor.shutdown(wait=True, cancel_futures=True)
+            self.socket_executor.shutdown(wait=False)
+
+    async def run_state(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.state_executor, func, *args)
+
+    async def feed_task(self, stream_source):
+        while True:
+            if self.shard.is_leader():
+                await self.run_state(self.check_feed, stream_source)
+            await asyncio.sleep(self.event_loop_config["feed_interval"])
+
+    async def posts_task(self):
+        while True:
+            if self.shard.is_leader():
+                await self.run_state(self.check_posts)
+            await asyncio.sleep(self.event_loop_config["posts_interval"])
+
+    async def persistence_task(self):
+        while True:
+            await asyncio.sleep(self.persistence.interval)
+            await self.run_state(self.persistence.flush_due)
+
+    async def sockets_task(self):
+        while True:
+            await self.run_state(self.sync_store)
+            await self.run_state(self.add_new_sockets)
+            await self.run_state(self.remove_old_sockets)
+            await self.run_state(self.coalescer.flush_due)
+            try:
+                await asyncio.wait_for(
+                    self.sockets_wake.wait(), self.event_loop_config["sockets_interval"]
+                )
+            except asyncio.TimeoutError:
+                pass
+            self.sockets_wake.clear()
 
-            self.check_posts()
+    async def socket_pump_task(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            envelopes, closed = await loop.run_in_executor(
+                self.socket_executor,
+                self.poll_sockets,
+                self.event_loop_config["socket_poll_timeout"],
+            )
+            if envelopes or closed:
+                await self.run_state(self.dispatch_socket_frames, envelopes, closed)
 
-            self.add_new_sockets()
-            self.remove_old_sockets()
-            self.check_sockets()
+    def shutdown(self):
+        # Replies still held for their mentions go out now rather than never.
+        self.coalescer.flush_due(float("inf"))
+        self.outbound.shutdown()
+        for dispatcher in self.announcement_dispatchers:
+            dispatcher.shutdown()
+        self.resolver.shutdown()
+        self.persistence.flush()
+        if self.store is not None:
+            self.store.close()
+        self.browser_pool.shutdown()
+        metrics.REGISTRY.shutdown()
 
     def run_with_respawn(self):
         while True:
             try:
-                self.run()
+                if self.run_mode == "async":
+                    self.run_async()
+                else:
+                    self.run()
             except praw.exceptions.RedditAPIException as api_exception:
                 errors = {error.error_type: error.message for error in api_exception.items}
                 if "RATELIMIT" in errors:
                     logger.error(f"Rate Limit hit! Exception message: {errors['RATELIMIT']}")
-                    sleep = 0
-                    if ("minute" in errors["RATELIMIT"]) or ("minutes" in errors["RATELIMIT"]):
-                        sleep = int(errors["RATELIMIT"].split(" ")[-2]) * 60 + 5
-                    elif ("second" in errors["RATELIMIT"]) or ("seconds" in errors["RATELIMIT"]):
-                        sleep = int(errors["RATELIMIT"].split(" ")[-2])
-                    elif ("hour" in errors["RATELIMIT"]) or ("hours" in errors["RATELIMIT"]):
-                        sleep = int(int(errors["RATELIMIT"].split(" ")[-2]) * 3600 + 60)
+                    sleep = utils.ratelimit_sleep(errors["RATELIMIT"])
 
                     logger.warning(f"sleeping for {sleep} seconds")
                     time.sleep(sleep)
@@ -401,32 +1162,7 @@ class UTC_Formatter(logging.Formatter):
     converter = time.gmtime
 
 
-class DiscordHandler(logging.Handler):
-    def __init__(self, webhooks, mention):
-        logging.Handler.__init__(self)
-        self.webhook = discord_webhook.DiscordWebhook(webhooks)
-        self.mention = ", ".join(mention)
-
-    def emit(self, record):
-        try:
-            msg = self.format(record)
-            if record.levelno in (logging.WARN, logging.INFO):
-                utils.webhook_post(self.webhook, f"`{msg}`")
-            if record.levelno in (logging.ERROR, logging.CRITICAL):
-                utils.webhook_post(
-                    self.webhook,
-                    f"{self.mention} `{msg}`",
-                )
-        except Exception:
-            self.handleError(record)
-
-
-if __name__ == "__main__":
-    script_dir = Path(__file__).resolve().parent
-    config_dir = script_dir / "config"
-    config = utils.load_json(config_dir / "config.json")
-
-    # setup logging
+def setup_logging(config: Dict) -> logging.Logger:
     logger = logging.getLogger("bot")
     logger.setLevel(logging.INFO)
     formatter = UTC_Formatter(
@@ -444,18 +1180,92 @@ if __name__ == "__main__":
     logger.addHandler(consolehandler)
 
     if config["errors_webhook"]["hooks"]:
-        discord_handler = DiscordHandler(
-            config["errors_webhook"]["hooks"], config["errors_webhook"]["mention"]
+        discord_handler = discord_logging.QueuedDiscordHandler(
+            config["errors_webhook"]["hooks"],
+            config["errors_webhook"]["mention"],
+            **utils.config_section(
+                config,
+                "errors_webhook_queue",
+                {"max_queue": 500, "batch_interval": 2.0, "timeout": 10.0, "max_retries": 3},
+            ),
         )
         # discord_handler.setLevel(logging.INFO)
         discord_handler.setFormatter(formatter)
         logger.addHandler(discord_handler)
+    return logger
+
+
+def stop_on_signals():
+    # Service managers stop the bot with SIGTERM, handled like Ctrl+C so shutdown() still
+    # flushes pending writes. Later signals are ignored so they can't cut that flush short.
+    def interrupt(signum, frame):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        raise KeyboardInterrupt
 
-    logger.info("Initializing bot")
-    bot = Bot(script_dir, config_dir, config)
+    signal.signal(signal.SIGINT, interrupt)
+    signal.signal(signal.SIGTERM, interrupt)
+
+
+def run_shard(script_dir: Path, config_dir: Path, config: Dict, index: int, count: int, alive):
+    # Entry point of each sharded worker process, see sharding.Supervisor.
+    global logger
+    stop_on_signals()
+    startup_timer = utils.StartupTimer()
+    logger = setup_logging(config)
+    logger.info(f"Initializing shard {index} of {count}")
+    shard = sharding.ShardView(index, count, alive)
+    bot = Bot(script_dir, config_dir, config, startup_timer, shard)
+    # Only now do the other shards hand over this shard's streams and, for shard 0, the feeds.
+    shard.mark_alive()
     try:
         bot.run_with_respawn()
+    except KeyboardInterrupt:
+        logger.info(f"Shard {index} interrupted, shutting down.")
+        bot.shutdown()
     except Exception as e:
-        bot.webdriver.close()
-        bot.webdriver.quit()
-        logger.critical(f"Program crashing out with '{e}' as exception")
+        bot.shutdown()
+        logger.critical(f"Shard {index} crashing out with '{e}' as exception")
+        raise
+
+
+if __name__ == "__main__":
+    startup_timer = utils.StartupTimer()
+    script_dir = Path(__file__).resolve().parent
+    config_dir = script_dir / "config"
+    config = utils.load_json(config_dir / "config.json")
+
+    logger = setup_logging(config)
+    stop_on_signals()
+    startup_timer.mark("config load")
+
+    if config.get("run_mode") == "sharded":
+        sharding_config = utils.config_section(
+            config,
+            "sharding",
+            {"workers": 4, "respawn_delay": 5.0, "check_interval": 1.0},
+        )
+        supervisor = sharding.Supervisor(
+            run_shard,
+            script_dir,
+            config_dir,
+            config,
+            workers=sharding_config["workers"],
+            respawn_delay=sharding_config["respawn_delay"],
+            check_interval=sharding_config["check_interval"],
+        )
+        try:
+            supervisor.run()
+        except KeyboardInterrupt:
+            logger.info("Interrupted, waiting for shards to shut down.")
+    else:
+        logger.info("Initializing bot")
+        bot = Bot(script_dir, config_dir, config, startup_timer)
+        try:
+            bot.run_with_respawn()
+        except KeyboardInterrupt:
+            logger.info("Interrupted, shutting down.")
+            bot.shutdown()
+        except Exception as e:
+            bot.shutdown()
+            logger.critical(f"Program crashing out with '{e}' as exception")
@@ -0,0 +1,185 @@
+from typing import Optional, Dict, List, Deque
+from collections import deque
+from pathlib import Path
+import threading
+import logging
+import queue
+import time
+
+import utils
+
+logger = logging.getLogger("bot.browser_pool")
+
+
+class BrowserWorker:
+    def __init__(self, pool: "BrowserPool", number: int):
+        self.pool = pool
+        self.number = number
+        self.jobs: queue.Queue = queue.Queue()
+        self.driver = None
+        self.uses = 0
+        self.post_id: Optional[str] = None
+        self.parked_at = 0.0
+        self.idle_since = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name=f"bot-browser-{number}", daemon=True)
+
+    def run(self):
+        while True:
+            try:
+                job, post_id = self.jobs.get(timeout=1.0)
+            except queue.Empty:
+                self.pool.check_fairness(self)
+                self.check_idle()
+                continue
+
+            if job == "stop":
+                self.quit()
+                return
+
+            try:
+                if job == "load":
+                    self.launch()
+                    self.driver.get(f"http://redd.it/{post_id}")
+                    self.uses += 1
+                    logger.info(f"Webdriver {self.number} loaded to {post_id}")
+                elif job == "refresh" and self.driver is not None:
+                    self.driver.refresh()
+                    self.uses += 1
+                    logger.info(f"Webdriver {self.number} reloaded {post_id}.")
+                elif job == "release":
+                    if self.driver is not None:
+                        self.driver.get("about:blank")
+                    if self.uses >= self.pool.max_uses:
+                        # Chrome leaks memory over long sessions, start fresh every max_uses loads.
+                        logger.debug(f"Recycling webdriver {self.number} after {self.uses} uses.")
+                        self.quit()
+            except Exception as e:
+                logger.error(f"Webdriver {self.number} excepted {e} on {job} {post_id}")
+                self.quit()
+
+            if job == "release":
+                self.pool.worker_free(self)
+
+    def check_idle(self):
+        # Free workers give Chrome's memory back once nothing has needed them for a while.
+        if self.driver is None or self.post_id is not None:
+            return
+        if time.monotonic() - self.idle_since >= self.pool.idle_timeout:
+            logger.info(f"Webdriver {self.number} idle, shutting it down.")
+            self.quit()
+
+    def launch(self):
+        if self.driver is None:
+            logger.debug(f"Starting chrome webdriver {self.number}")
+            self.driver = utils.launch_chrome(self.pool.chromedriver_path)
+            self.uses = 0
+            self.pool.launches += 1
+
+    def quit(self):
+        if self.driver is None:
+            return
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.debug(f"Webdriver {self.number} excepted {e} while quitting")
+        self.driver = None
+
+
+class BrowserPool:
+    def __init__(
+        self,
+        chromedriver_path: Path,
+        size: int = 1,
+        max_uses: int = 20,
+        max_park: float = 300.0,
+        idle_timeout: float = 600.0,
+    ):
+        self.chromedriver_path = chromedriver_path
+        self.max_uses = max_uses
+        self.max_park = max_park
+        self.idle_timeout = idle_timeout
+
+        # Reentrant so refresh can fall back to load while holding it.
+        self.lock = threading.RLock()
+        self.workers = [BrowserWorker(self, number) for number in range(size)]
+        self.free: List[BrowserWorker] = list(self.workers)
+        self.parked: Dict[str, BrowserWorker] = {}
+        self.waiting: Deque[str] = deque()
+        self.launches = 0
+
+        # Threads are cheap, Chrome is only launched once a worker gets its first page.
+        for worker in self.workers:
+            worker.thread.start()
+
+    def assign(self, worker: BrowserWorker, post_id: str):
+        worker.post_id = post_id
+        worker.parked_at = time.monotonic()
+        self.parked[post_id] = worker
+        worker.jobs.put(("load", post_id))
+
+    def load(self, post_id: str):
+        with self.lock:
+            if post_id in self.parked or post_id in self.waiting:
+                return
+            if self.free:
+                self.assign(self.free.pop(), post_id)
+            else:
+                logger.info(f"All webdrivers busy, {post_id} queued behind {len(self.waiting)} posts.")
+                self.waiting.append(post_id)
+
+    def refresh(self, post_id: str):
+        with self.lock:
+            worker = self.parked.get(post_id)
+            if worker is None:
+                self.load(post_id)
+            else:
+                worker.jobs.put(("refresh", post_id))
+
+    def release(self, post_id: str):
+        with self.lock:
+            if post_id in self.waiting:
+                self.waiting.remove(post_id)
+            worker = self.parked.pop(post_id, None)
+            if worker is not None:
+                worker.jobs.put(("release", post_id))
+
+    def worker_free(self, worker: BrowserWorker):
+        with self.lock:
+            worker.post_id = None
+            worker.idle_since = time.monotonic()
+            if self.waiting:
+                self.assign(worker, self.waiting.popleft())
+            else:
+                self.free.append(worker)
+
+    def check_fairness(self, worker: BrowserWorker):
+        # A post that has held a browser for max_park goes to the back of the queue, so one
+        # stubborn stream can't starve everything waiting behind it.
+        with self.lock:
+            post_id = worker.post_id
+            if post_id is None or not self.waiting:
+                return
+            if self.parked.get(post_id) is not worker:
+                return
+            if time.monotonic() - worker.parked_at < self.max_park:
+                return
+            logger.info(f"Webdriver {worker.number} parked on {post_id} too long, rotating.")
+            self.parked.pop(post_id)
+            self.waiting.append(post_id)
+            worker.jobs.put(("release", post_id))
+
+    def report(self) -> Dict:
+        with self.lock:
+            return {
+                "size": len(self.workers),
+                "running": sum(worker.driver is not None for worker in self.workers),
+                "parked": sorted(self.parked),
+                "waiting": list(self.waiting),
+                "launches": self.launches,
+            }
+
+    def shutdown(self, timeout: float = 5.0):
+        for worker in self.workers:
+            worker.jobs.put(("stop", None))
+        for worker in self.workers:
+            worker.thread.join(timeout=timeout)
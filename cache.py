@@ -0,0 +1,99 @@
+from typing import Optional, Dict, Any, Callable, Hashable
+from collections import OrderedDict
+import threading
+import logging
+import time
+
+from prawcore import NotFound
+import praw
+
+logger = logging.getLogger("bot.cache")
+
+FOREVER = None
+
+
+class TTLCache:
+    def __init__(self, name: str, ttl: Optional[float], max_entries: int = 1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Loaded outside the lock, two threads missing at once both load, which is harmless.
+        value = loader()
+        expires = None if self.ttl is None else now + self.ttl
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def report(self) -> Dict:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class MetadataCache:
+    def __init__(
+        self,
+        reddit: praw.Reddit,
+        live_comments_ttl: float = 300.0,
+        redditor_ttl: float = 3600.0,
+        max_entries: int = 1024,
+    ):
+        self.reddit = reddit
+        self.caches = {
+            "identity": TTLCache("identity", FOREVER, 1),
+            "fullname": TTLCache("fullname", FOREVER, max_entries),
+            "allow_live_comments": TTLCache("allow_live_comments", live_comments_ttl, max_entries),
+            "redditor_exists": TTLCache("redditor_exists", redditor_ttl, max_entries),
+        }
+
+    def bot_name(self) -> str:
+        return self.caches["identity"].get("me", lambda: self.reddit.user.me().name)
+
+    def fullname(self, post_id: str) -> str:
+        return self.caches["fullname"].get(
+            post_id, lambda: self.reddit.submission(post_id).fullname
+        )
+
+    def allow_live_comments(self, post_id: str) -> Optional[bool]:
+        # None means the submission has no live comments at all, i.e. it's a regular post.
+        def load() -> Optional[bool]:
+            try:
+                return bool(self.reddit.submission(post_id).allow_live_comments)
+            except AttributeError:
+                return None
+
+        return self.caches["allow_live_comments"].get(post_id, load)
+
+    def redditor_exists(self, redditor_name: str) -> bool:
+        def load() -> bool:
+            try:
+                self.reddit.redditor(redditor_name).id
+                return True
+            except NotFound:
+                return False
+
+        return self.caches["redditor_exists"].get(redditor_name.lower(), load)
+
+    def report(self) -> Dict[str, Dict]:
+        return {name: cache.report() for name, cache in self.caches.items()}
@@ -0,0 +1,96 @@
+from typing import Optional, Dict, List, Hashable
+from collections import OrderedDict
+import logging
+import time
+
+from envelope import MessageEnvelope
+
+logger = logging.getLogger("bot.coalescer")
+
+
+class CoalescedReply:
+    __slots__ = ("new_message", "reply", "requesters", "expires_at", "sent")
+
+    def __init__(self, new_message: MessageEnvelope, reply: str, expires_at: float):
+        self.new_message = new_message
+        self.reply = reply
+        self.requesters: List[str] = [new_message.author]
+        self.expires_at = expires_at
+        self.sent = False
+
+
+class ReplyCoalescer:
+    def __init__(
+        self,
+        outbound,
+        window: float = 10.0,
+        max_entries: int = 512,
+        mention_requesters: bool = False,
+        max_mentions: int = 5,
+    ):
+        self.outbound = outbound
+        self.window = window
+        self.max_entries = max_entries
+        # Holds the reply until the window closes, so it can name everyone who asked.
+        self.mention_requesters = mention_requesters
+        self.max_mentions = max_mentions
+        # Every entry gets the same window, so insertion order is also expiry order.
+        self.entries: "OrderedDict[Hashable, CoalescedReply]" = OrderedDict()
+        self.sent = 0
+        self.suppressed = 0
+
+    def reply(self, key: Optional[Hashable], new_message: MessageEnvelope, reply: str) -> bool:
+        # False when an identical reply already went, or is going, to the same stream.
+        if key is None or self.window <= 0:
+            self.outbound.reply(new_message, reply)
+            self.sent += 1
+            return True
+
+        now = time.monotonic()
+        self.flush_due(now)
+        entry = self.entries.get(key)
+        if entry is not None:
+            if new_message.author not in entry.requesters:
+                entry.requesters.append(new_message.author)
+            self.suppressed += 1
+            return False
+
+        entry = self.entries[key] = CoalescedReply(new_message, reply, now + self.window)
+        if not self.mention_requesters:
+            self.send(entry)
+        while len(self.entries) > self.max_entries:
+            self.expire(self.entries.popitem(last=False)[1])
+        return True
+
+    def flush_due(self, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        while self.entries:
+            entry = next(iter(self.entries.values()))
+            if entry.expires_at > now:
+                return
+            self.entries.popitem(last=False)
+            self.expire(entry)
+
+    def expire(self, entry: CoalescedReply):
+        if not entry.sent:
+            self.send(entry)
+        if len(entry.requesters) > 1:
+            logger.debug(
+                f"Coalesced {len(entry.requesters)} requests for '{entry.new_message.body}' in {entry.new_message.submission_id}"
+            )
+
+    def send(self, entry: CoalescedReply):
+        reply = entry.reply
+        if self.mention_requesters:
+            mentions = ", ".join(f"u/{name}" for name in entry.requesters[: self.max_mentions])
+            extra = len(entry.requesters) - self.max_mentions
+            if extra > 0:
+                mentions += f" and {extra} more"
+            reply = f"{mentions}: {reply}"
+        self.outbound.reply(entry.new_message, reply)
+        entry.sent = True
+        self.sent += 1
+
+    def report(self) -> Dict:
+        return {"entries": len(self.entries), "sent": self.sent, "suppressed": self.suppressed}
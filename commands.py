@@ -1,18 +1,78 @@
-from typing import Optional, Dict, List, Set, Tuple
+from typing import Optional, Dict, List, Set, Tuple, FrozenSet, Callable
+from functools import partial
 from pathlib import Path
 import logging
 
-from prawcore import NotFound
 import praw
 
+from envelope import MessageEnvelope
+import metrics
 import utils
 
 logger = logging.getLogger("bot.commands")
 
+COMMAND_PREFIX = "!"
+MAX_MESSAGE_LENGTH = 45
+
+
+class CommandSpec:
+    def __init__(
+        self,
+        name: str,
+        handler: Optional[Callable],
+        args: Tuple[str, ...] = (),
+        optional_args: int = 0,
+    ):
+        self.name = name
+        self.handler = handler
+        self.args = args
+        self.min_args = len(args) - optional_args
+        self.subcommands: Dict[str, "CommandSpec"] = {}
+
 
 class Commands:
     def __init__(self, parent):
         self.parent = parent
+        self.registry: Dict[str, CommandSpec] = {}
+
+        # The optional redditor picks whose subscriber list, when several streamers are watched.
+        self.register(
+            CommandSpec("!subscribe", self.subscribe, args=("redditor",), optional_args=1)
+        )
+        self.register(
+            CommandSpec("!unsubscribe", self.unsubscribe, args=("redditor",), optional_args=1)
+        )
+        self.register(
+            CommandSpec("!subother", self.subother, args=("user", "redditor"), optional_args=1)
+        )
+        self.register(
+            CommandSpec("!unsubother", self.unsubother, args=("user", "redditor"), optional_args=1)
+        )
+        self.register(CommandSpec("!monitor", self.monitor, args=("post_id",)))
+        self.register(CommandSpec("!end", self.end, args=("post_id",), optional_args=1))
+        self.register(CommandSpec("!reload commands", self.reload_commands))
+
+        # Basic commands are registered last so they override a built in of the same name, as
+        # they did when they were checked first.
+        for name, this_command in self.parent.basic_commands.items():
+            self.register(
+                CommandSpec(name.lower(), partial(self.basic_commands_func, this_command))
+            )
+
+    def register(self, spec: CommandSpec):
+        words = spec.name.split()
+        if len(words) > 2:
+            logger.warning(f"Command '{spec.name}' has more than two words, ignoring it.")
+            return
+        if len(words) == 2:
+            # Multi word commands hang off their first word, e.g. "!reload commands".
+            parent_spec = self.registry.setdefault(words[0], CommandSpec(words[0], None))
+            parent_spec.subcommands[words[1]] = spec
+        else:
+            existing = self.registry.get(spec.name)
+            if existing is not None:
+                spec.subcommands = existing.subcommands
+            self.registry[spec.name] = spec
 
     def log(
         self,
@@ -24,6 +84,8 @@ class Commands:
         reply: Optional[str] = None,
         log_level: int = logging.INFO,
     ):
+        if not logger.isEnabledFor(log_level):
+            return
         _submission = " at " + submission_id if submission_id is not None else ""
         _notices = " | " + " | ".join(notices) if notices is not None else ""
         _reply = " | " + reply if reply is not None else ""
@@ -39,12 +101,9 @@ class Commands:
         context: str,
         submission_id: Optional[str],
         log: bool = True,
-    ) -> Tuple[bool, Set[str]]:
+    ) -> Tuple[bool, FrozenSet[str]]:
 
-        user_permissions = set()
-        for permission, user_names in self.parent.users.items():
-            if author in user_names:
-                user_permissions.add(permission)
+        user_permissions = self.parent.role_index.roles_of(author)
 
         if not "any" in access:
             if not access.intersection(user_permissions):
@@ -58,12 +117,34 @@ class Commands:
 
         return True, user_permissions
 
-    def subscribe(self, new_message: Dict) -> Tuple[Optional[str], Optional[str]]:
-        message = new_message["message"]
-        body = new_message["body"]
-        context = new_message["context"]
-        author = new_message["author"]
-        submission_id = new_message["submission_id"]
+    def subscriber_role(self, args: List[str], index: int) -> Optional[str]:
+        if len(args) <= index:
+            return "subscribers"
+        redditor_name = args[index]
+        if redditor_name.startswith("u/"):
+            redditor_name = redditor_name[len("u/") :]
+        watched = self.parent.watched_redditors.get(redditor_name.lower())
+        return watched["subscriber_role"] if watched is not None else None
+
+    def not_watched(
+        self, new_message: MessageEnvelope, command: str
+    ) -> Tuple[Optional[str], Optional[str]]:
+        reply = f"{new_message.args[-1]} is not a watched redditor."
+        self.parent.outbound.reply(new_message, reply)
+        self.log(
+            command,
+            new_message.author,
+            new_message.context,
+            new_message.submission_id,
+            reply=reply,
+        )
+        return None, None
+
+    def subscribe(self, new_message: MessageEnvelope) -> Tuple[Optional[str], Optional[str]]:
+        body = new_message.body
+        context = new_message.context
+        author = new_message.author
+        submission_id = new_message.submission_id
 
         command = "!subscribe"
 
@@ -72,48 +153,55 @@ class Commands:
         if not allowed:
             return None, None
 
-        if author not in self.parent.users["subscribers"]:
-            self.parent.users["subscribers"].append(author)
+        role = self.subscriber_role(new_message.args, 0)
+        if role is None:
+            return self.not_watched(new_message, command)
+
+        if not self.parent.role_index.has(author, role):
+            self.parent.add_to_role(role, author)
 
             reply = f"u/{author} has been subscribed. Use !unsubscribe to unsubscribe."
-            message.reply(reply)
+            self.parent.outbound.reply(new_message, reply)
             self.log(command, author, context, submission_id, reply=reply)
             return "users", "save"
         else:
             reply = f"u/{author} was already subscribed."
-            message.reply(reply)
+            self.parent.outbound.reply(new_message, reply)
             self.log(command, author, context, submission_id, reply=reply)
             return None, None
 
-    def unsubscribe(self, new_message: Dict) -> Tuple[Optional[str], Optional[str]]:
-        message = new_message["message"]
-        body = new_message["body"]
-        context = new_message["context"]
-        author = new_message["author"]
-        submission_id = new_message["submission_id"]
+    def unsubscribe(self, new_message: MessageEnvelope) -> Tuple[Optional[str], Optional[str]]:
+        body = new_message.body
+        context = new_message.context
+        author = new_message.author
+        submission_id = new_message.submission_id
 
         command = "!unsubscribe"
 
-        if author in self.parent.users["subscribers"]:
-            self.parent.users["subscribers"].remove(author)
+        role = self.subscriber_role(new_message.args, 0)
+        if role is None:
+            return self.not_watched(new_message, command)
+
+        if self.parent.role_index.has(author, role):
+            self.parent.remove_from_role(role, author)
 
             reply = f"u/{author} has been unsubscribed."
-            message.reply(reply)
+            self.parent.outbound.reply(new_message, reply)
             self.log(command, author, context, submission_id, reply=reply)
             return "users", "save"
         else:
-            message.reply(reply)
+            reply = f"u/{author} was not subscribed."
+            self.parent.outbound.reply(new_message, reply)
             self.log(command, author, context, submission_id, reply=reply)
             return None, None
 
-    def subother(self, new_message: Dict) -> Tuple[Optional[str], Optional[str]]:
-        message = new_message["message"]
-        body = new_message["body"]
-        context = new_message["context"]
-        author = new_message["author"]
-        submission_id = new_message["submission_id"]
+    def subother(self, new_message: MessageEnvelope) -> Tuple[Optional[str], Optional[str]]:
+        body = new_message.body
+        context = new_message.context
+        author = new_message.author
+        submission_id = new_message.submission_id
 
-        to_subscribe = body.split(" ")[1]
+        to_subscribe = new_message.args[0]
         if to_subscribe.startswith("u/"):
             to_subscribe = to_subscribe[len("u/") :]
 
@@ -124,34 +212,36 @@ class Commands:
         if not allowed:
             return None, None
 
-        try:
-            self.parent.reddit.redditor(to_subscribe).id
-            if to_subscribe not in self.parent.users["subscribers"]:
-                self.parent.users["subscribers"].append(to_subscribe)
+        role = self.subscriber_role(new_message.args, 1)
+        if role is None:
+            return self.not_watched(new_message, command)
+
+        if self.parent.metadata.redditor_exists(to_subscribe):
+            if not self.parent.role_index.has(to_subscribe, role):
+                self.parent.add_to_role(role, to_subscribe)
 
                 reply = f"u/{to_subscribe} has been subscribed. Use !unsubscribe to unsubscribe."
-                message.reply(reply)
+                self.parent.outbound.reply(new_message, reply)
                 self.log(command, author, context, submission_id, reply=reply)
                 return "users", "save"
             else:
                 reply = f"u/{to_subscribe} was already subscribed."
-                message.reply(f"u/{to_subscribe} was already subscribed.")
+                self.parent.outbound.reply(new_message, reply)
                 self.log(command, author, context, submission_id, reply=reply)
                 return None, None
-        except NotFound:
+        else:
             reply = f"u/{to_subscribe} not found."
-            message.reply(reply)
+            self.parent.outbound.reply(new_message, reply)
             self.log(command, author, context, submission_id, reply=reply)
             return None, None
 
-    def unsubother(self, new_message: Dict) -> Tuple[Optional[str], Optional[str]]:
-        message = new_message["message"]
-        body = new_message["body"]
-        context = new_message["context"]
-        author = new_message["author"]
-        submission_id = new_message["submission_id"]
+    def unsubother(self, new_message: MessageEnvelope) -> Tuple[Optional[str], Optional[str]]:
+        body = new_message.body
+        context = new_message.context
+        author = new_message.author
+        submission_id = new_message.submission_id
 
-        to_unsubscribe = body.split(" ")[1]
+        to_unsubscribe = new_message.args[0]
         if to_unsubscribe.startswith("u/"):
             to_unsubscribe = to_unsubscribe[len("u/") :]
 
@@ -162,27 +252,30 @@ class Commands:
         if not allowed:
             return None, None
 
-        if to_unsubscribe in self.parent.users["subscribers"]:
-            self.parent.users["subscribers"].remove(to_unsubscribe)
+        role = self.subscriber_role(new_message.args, 1)
+        if role is None:
+            return self.not_watched(new_message, command)
+
+        if self.parent.role_index.has(to_unsubscribe, role):
+            self.parent.remove_from_role(role, to_unsubscribe)
 
             reply = f"u/{to_unsubscribe} has been unsubscribed."
-            message.reply(reply)
+            self.parent.outbound.reply(new_message, reply)
             self.log(command, author, context, submission_id, reply=reply)
             return "users", "save"
         else:
             reply = f"u/{to_unsubscribe} was not previously subscribed."
-            message.reply(reply)
+            self.parent.outbound.reply(new_message, reply)
             self.log(command, author, context, submission_id, reply=reply)
             return None, None
 
-    def monitor(self, new_message: Dict) -> Tuple[Optional[str], Optional[str]]:
-        message = new_message["message"]
-        body = new_message["body"]
-        context = new_message["context"]
-        author = new_message["author"]
-        submission_id = new_message["submission_id"]
+    def monitor(self, new_message: MessageEnvelope) -> Tuple[Optional[str], Optional[str]]:
+        body = new_message.body
+        context = new_message.context
+        author = new_message.author
+        submission_id = new_message.submission_id
 
-        to_monitor = body.split(" ")[1]
+        to_monitor = new_message.args[0]
 
         command = f"!monitor {to_monitor}"
 
@@ -193,47 +286,45 @@ class Commands:
 
         submission = self.parent.reddit.submission(to_monitor)
 
-        try:
-            submission.allow_live_comments
+        if self.parent.metadata.allow_live_comments(to_monitor) is not None:
             if to_monitor not in self.parent.monitored_streams["monitored"]:
                 if to_monitor in self.parent.monitored_streams["unmonitored"]:
-                    self.parent.monitored_streams["monitored"][
-                        to_monitor
-                    ] = self.parent.monitored_streams["unmonitored"][to_monitor]
+                    self.parent.monitored_streams["monitored"][to_monitor] = (
+                        self.parent.monitored_streams["unmonitored"][to_monitor]
+                    )
                     self.parent.monitored_streams["unmonitored"].pop(to_monitor)
                 else:
                     self.parent.monitored_streams["monitored"][to_monitor] = None
 
                 reply = f"Stream {to_monitor} is now being monitored."
-                message.reply(reply)
+                self.parent.outbound.reply(new_message, reply)
                 self.log(command, author, context, submission_id, reply=reply)
                 return "monitored_streams", "save"
             else:
                 reply = f"Stream {to_monitor} already being monitored."
-                message.reply(reply)
+                self.parent.outbound.reply(new_message, reply)
                 self.log(command, author, context, submission_id, reply=reply)
                 return None, None
 
-        except AttributeError:
+        else:
             if to_monitor not in self.parent.monitored_posts:
-                self.parent.monitored_posts[to_monitor] = len(submission.comments.list())
+                self.parent.monitored_posts[to_monitor] = self.parent.new_post_cursor(submission)
 
                 reply = f"Post {to_monitor} is now being monitored."
-                message.reply(reply)
+                self.parent.outbound.reply(new_message, reply)
                 self.log(command, author, context, submission_id, reply=reply)
                 return "monitored_posts", "save"
             else:
                 reply = f"Post {to_monitor} already being monitored."
-                message.reply(reply)
+                self.parent.outbound.reply(new_message, reply)
                 self.log(command, author, context, submission_id, reply=reply)
                 return None, None
 
-    def end(self, new_message: Dict) -> Tuple[Optional[str], Optional[str]]:
-        message = new_message["message"]
-        body = new_message["body"]
-        context = new_message["context"]
-        author = new_message["author"]
-        submission_id = new_message["submission_id"]
+    def end(self, new_message: MessageEnvelope) -> Tuple[Optional[str], Optional[str]]:
+        body = new_message.body
+        context = new_message.context
+        author = new_message.author
+        submission_id = new_message.submission_id
 
         access = {"admins", "moderators"}
 
@@ -247,23 +338,27 @@ class Commands:
                 return None, None
 
             if submission_id in self.parent.monitored_streams["monitored"]:
-                self.parent.monitored_streams["unmonitored"][
-                    submission_id
-                ] = self.parent.monitored_streams["monitored"][submission_id]
+                self.parent.monitored_streams["unmonitored"][submission_id] = (
+                    self.parent.monitored_streams["monitored"][submission_id]
+                )
                 self.parent.monitored_streams["monitored"].pop(submission_id)
 
                 reply = f"{context.title()} {submission_id} is no longer being monitored."
-                message.reply(reply)
+                self.parent.outbound.reply(new_message, reply)
                 self.log(command, author, context, submission_id, reply=reply)
                 return "monitored_streams", "save"
             else:
                 reply = f"{context.title()} {submission_id} was not being monitored."
-                message.reply(reply)
+                self.parent.outbound.reply(new_message, reply)
                 self.log(command, author, context, submission_id, reply=reply)
                 return None, None
 
         elif context == "inbox":
-            to_unmonitor = body.split(" ")[1]
+            if not new_message.args:
+                notices = ["Missing argument", "Usage: !end post_id"]
+                self.log("!end", author, context, submission_id, notices)
+                return None, None
+            to_unmonitor = new_message.args[0]
 
             command = f"!end {to_unmonitor}"
 
@@ -271,36 +366,34 @@ class Commands:
             if not allowed:
                 return None, None
 
-            submission = self.parent.reddit.submission(to_unmonitor)
-            try:
-                submission.allow_live_comments
+            if self.parent.metadata.allow_live_comments(to_unmonitor) is not None:
                 if to_unmonitor in self.parent.monitored_streams["monitored"]:
-                    self.parent.monitored_streams["unmonitored"][
-                        to_unmonitor
-                    ] = self.parent.monitored_streams["monitored"][to_unmonitor]
+                    self.parent.monitored_streams["unmonitored"][to_unmonitor] = (
+                        self.parent.monitored_streams["monitored"][to_unmonitor]
+                    )
                     self.parent.monitored_streams["monitored"].pop(to_unmonitor)
 
                     reply = f"Stream {to_unmonitor} is no longer being monitored."
-                    message.reply(reply)
+                    self.parent.outbound.reply(new_message, reply)
                     self.log(command, author, context, submission_id, reply=reply)
                     return "monitored_streams", "save"
                 else:
                     reply = f"Stream {to_unmonitor} was not being monitored."
-                    message.reply(reply)
+                    self.parent.outbound.reply(new_message, reply)
                     self.log(command, author, context, submission_id, reply=reply)
                     return None, None
 
-            except AttributeError:
+            else:
                 if to_unmonitor in self.parent.monitored_posts:
                     self.parent.monitored_posts.pop(to_unmonitor)
 
                     reply = f"Post {to_unmonitor} is no longer being monitored."
-                    message.reply(reply)
+                    self.parent.outbound.reply(new_message, reply)
                     self.log(command, author, context, submission_id, reply=reply)
                     return "monitored_posts", "save"
                 else:
                     reply = f"Post {to_unmonitor} was not being monitored."
-                    message.reply(reply)
+                    self.parent.outbound.reply(new_message, reply)
                     self.log(command, author, context, submission_id, reply=reply)
 
                     return None, None
@@ -308,11 +401,11 @@ class Commands:
         else:
             return None, None
 
-    def reload_commands(self, new_message: Dict) -> Tuple[Optional[str], Optional[str]]:
-        context = new_message["context"]
-        body = new_message["body"]
-        author = new_message["author"]
-        submission_id = new_message["submission_id"]
+    def reload_commands(self, new_message: MessageEnvelope) -> Tuple[Optional[str], Optional[str]]:
+        context = new_message.context
+        body = new_message.body
+        author = new_message.author
+        submission_id = new_message.submission_id
 
         command = "!reload commands"
 
@@ -322,16 +415,15 @@ class Commands:
             return None, None
 
         reply = "Commands queued to reload."
-        new_message["message"].reply(reply)
+        self.parent.outbound.reply(new_message, reply)
         self.log(command, author, context, submission_id, reply=reply)
         return "commands", "load"
 
-    def basic_commands_func(self, this_command: Dict, new_message: Dict):
-        message = new_message["message"]
-        context = new_message["context"]
-        body = new_message["body"]
-        author = new_message["author"]
-        submission_id = new_message["submission_id"]
+    def basic_commands_func(self, this_command: Dict, new_message: MessageEnvelope):
+        context = new_message.context
+        body = new_message.body
+        author = new_message.author
+        submission_id = new_message.submission_id
 
         command = body.lower()
 
@@ -351,53 +443,68 @@ class Commands:
             return
 
         reply_message = this_command["message"]
-        message.reply(reply_message)
+        # Inbox replies are private, only public threads get one reply per burst of requests.
+        key = (submission_id, command) if submission_id is not None else None
+        if not self.parent.coalescer.reply(key, new_message, reply_message):
+            self.log(command, author, context, submission_id, ["Coalesced"], None, logging.DEBUG)
+            return
         self.log(command, author, context, submission_id, reply=reply_message)
 
-    def check_message(self, new_message: Dict):
-        message = new_message["message"]
-        author = new_message["author"]
-        context = new_message["context"]
-        submission_id = new_message["submission_id"]
-        message_body_lower = new_message["body"].lower()
+    def check_message(self, new_message: MessageEnvelope):
+        author = new_message.author
+        context = new_message.context
+        submission_id = new_message.submission_id
+        body = new_message.body
 
         # TODO add in functionality to handle a u/Bot_Name mention, and reply.
         # TODO also add !at (comment/post) post_id
 
-        message_length = len(message_body_lower)
-        if message_length > 45:
-            notices = [f"Ignored due to message length ({len(message_body_lower)})."]
+        # Most chat isn't a command, so reject it before doing any other work.
+        if not body.startswith(COMMAND_PREFIX):
             self.log(
-                message_body_lower, author, context, submission_id, notices, None, logging.DEBUG
+                body, author, context, submission_id, ["No command found."], None, logging.DEBUG
             )
             return None, None
 
-        elif message_body_lower in self.parent.basic_commands:
-            this_command = self.parent.basic_commands[message_body_lower]
-            self.basic_commands_func(this_command, new_message)
+        if len(body) > MAX_MESSAGE_LENGTH:
+            notices = [f"Ignored due to message length ({len(body)})."]
+            self.log(body, author, context, submission_id, notices, None, logging.DEBUG)
             return None, None
 
-        elif message_body_lower == "!subscribe":
-            return self.subscribe(new_message)
-
-        elif message_body_lower == "!unsubscribe":
-            return self.unsubscribe(new_message)
+        words = body.split()
+        spec = self.registry.get(words[0].lower())
+        if spec is not None and spec.subcommands and len(words) > 1:
+            subcommand = spec.subcommands.get(words[1].lower())
+            if subcommand is not None:
+                spec = subcommand
+                words = words[1:]
 
-        elif "!subother" in message_body_lower:
-            return self.subother(new_message)
-
-        elif "!unsubother" in message_body_lower:
-            return self.unsubother(new_message)
-
-        elif "!monitor" in message_body_lower:
-            return self.monitor(new_message)
+        if spec is None or spec.handler is None:
+            self.log(
+                body, author, context, submission_id, ["No command found."], None, logging.DEBUG
+            )
+            return None, None
 
-        elif "!end" in message_body_lower:
-            return self.end(new_message)
+        args = words[1:]
+        if not spec.min_args <= len(args) <= len(spec.args):
+            notices = [
+                "Wrong number of arguments",
+                f"Usage: {' '.join((spec.name,) + spec.args)}",
+            ]
+            self.log(body, author, context, submission_id, notices, None, logging.DEBUG)
+            return None, None
 
-        elif message_body_lower == "!reload commands":
-            return self.reload_commands(new_message)
+        # Before any handler runs, so a spammer costs a dict lookup and not a reply.
+        if not self.parent.role_index.has(author, "admins") and not self.parent.flood_control.allow(
+            author, spec.name
+        ):
+            metrics.FLOOD_LIMITED.inc(spec.name)
+            self.log(body, author, context, submission_id, ["Flood limited."], None, logging.DEBUG)
+            return None, None
 
-        notices = ["No command found."]
-        self.log(message_body_lower, author, context, submission_id, notices, None, logging.DEBUG)
-        return None, None
\ No newline at end of file
+        new_message.args = args
+        metrics.COMMANDS.inc(spec.name)
+        result = spec.handler(new_message)
+        if result is None:
+            return None, None
+        return result
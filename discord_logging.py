@@ -0,0 +1,144 @@
+from typing import List
+import threading
+import logging
+import queue
+import time
+
+import requests
+
+# Deliberately not under "bot", this logger must never feed back into the handler below.
+logger = logging.getLogger("discord_logging")
+
+MAX_CONTENT_LENGTH = 2000
+STOP = None
+
+
+class QueuedDiscordHandler(logging.Handler):
+    def __init__(
+        self,
+        webhooks: List[str],
+        mention: List[str],
+        max_queue: int = 500,
+        batch_interval: float = 2.0,
+        timeout: float = 10.0,
+        max_retries: int = 3,
+    ):
+        logging.Handler.__init__(self)
+        self.webhooks = webhooks
+        self.mention = ", ".join(mention)
+        self.batch_interval = batch_interval
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+        self.session = requests.Session()
+        self.thread = threading.Thread(target=self.work, name="bot-discord-log", daemon=True)
+        self.thread.start()
+
+    def emit(self, record: logging.LogRecord):
+        if record.levelno < logging.INFO:
+            return
+        try:
+            line = f"`{self.format(record)}`"
+            if record.levelno >= logging.ERROR:
+                line = f"{self.mention} {line}"
+        except Exception:
+            self.handleError(record)
+            return
+
+        # Never block the caller: when Discord can't keep up, count what's lost instead.
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def work(self):
+        while True:
+            line = self.queue.get()
+            if line is STOP:
+                return
+
+            batch = [line]
+            deadline = time.monotonic() + self.batch_interval
+            stopping = False
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    line = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if line is STOP:
+                    stopping = True
+                    break
+                batch.append(line)
+
+            for content in self.build_messages(batch):
+                self.post(content)
+            if stopping:
+                return
+
+    def build_messages(self, batch: List[str]) -> List[str]:
+        with self.dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            batch.insert(0, f"`{dropped} log records dropped, Discord queue was full.`")
+
+        messages = []
+        content = ""
+        for line in batch:
+            if len(line) > MAX_CONTENT_LENGTH:
+                line = line[: MAX_CONTENT_LENGTH - 4] + "...`"
+            if content and len(content) + 1 + len(line) > MAX_CONTENT_LENGTH:
+                messages.append(content)
+                content = ""
+            content = f"{content}\n{line}" if content else line
+        if content:
+            messages.append(content)
+        return messages
+
+    def post(self, content: str):
+        for webhook in self.webhooks:
+            for _ in range(self.max_retries + 1):
+                try:
+                    response = self.session.post(
+                        webhook, json={"content": content}, timeout=self.timeout
+                    )
+                except requests.RequestException as e:
+                    logger.warning(f"Discord log webhook excepted {e}")
+                    break
+                if response.status_code != 429:
+                    if not response.ok:
+                        logger.warning(f"Discord log webhook returned {response.status_code}")
+                    break
+                time.sleep(self.retry_after(response))
+
+    @staticmethod
+    def retry_after(response: requests.Response) -> float:
+        header = response.headers.get("Retry-After")
+        if header is not None:
+            return float(header)
+        try:
+            return float(response.json().get("retry_after", 1.0))
+        except ValueError:
+            return 1.0
+
+    def flush(self):
+        deadline = time.monotonic() + self.timeout
+        while not self.queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def close(self):
+        # Called by logging.shutdown at exit, so queued records still make it out.
+        if self.thread.is_alive():
+            try:
+                self.queue.put(STOP, timeout=self.timeout)
+            except queue.Full:
+                pass
+            self.thread.join(timeout=self.timeout + self.batch_interval)
+        self.session.close()
+        logging.Handler.close(self)
@@ -0,0 +1,55 @@
+from typing import Optional, List
+
+import praw
+
+
+class MessageEnvelope:
+    # One of these is built per incoming message, so keep it small and defer the praw object
+    # until a handler actually replies.
+    __slots__ = (
+        "body",
+        "author",
+        "context",
+        "submission_id",
+        "args",
+        "comment_id",
+        "_message",
+        "_reddit",
+    )
+
+    def __init__(
+        self,
+        body: str,
+        author: str,
+        context: str,
+        submission_id: Optional[str],
+        message=None,
+        comment_id: Optional[str] = None,
+        reddit: Optional[praw.Reddit] = None,
+    ):
+        self.body = body
+        self.author = author
+        self.context = context
+        self.submission_id = submission_id
+        self.args: List[str] = []
+        self.comment_id = comment_id
+        self._message = message
+        self._reddit = reddit
+
+    @property
+    def message(self):
+        if self._message is None:
+            self._message = self._reddit.comment(self.comment_id)
+        return self._message
+
+    @property
+    def fullname(self) -> str:
+        if self._message is None:
+            return f"t1_{self.comment_id}"
+        return self._message.fullname
+
+    def reply(self, reply: str):
+        return self.message.reply(reply)
+
+    def __str__(self) -> str:
+        return f"u/{self.author} in {self.context}"
@@ -0,0 +1,350 @@
+from typing import Optional, Dict, List, Iterator
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import itertools
+import hashlib
+import logging
+import socket
+import struct
+import base64
+import json
+import time
+
+logger = logging.getLogger("bot.fakes")
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        text = digits[remainder] + text
+        if not number:
+            return text
+
+
+class FakeLiveCommentServer:
+    # Just enough RFC 6455 to look like Reddit's live comment sockets to websocket-client.
+    def __init__(self, host: str = "127.0.0.1"):
+        self.host = host
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, 0))
+        self.listener.listen(128)
+        self.port = self.listener.getsockname()[1]
+
+        self.lock = threading.Lock()
+        self.connections: Dict[str, socket.socket] = {}
+        self.frames_sent = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.accept, name="fake-live-comments", daemon=True)
+        self.thread.start()
+
+    def address(self, post_id: str) -> str:
+        return f"ws://{self.host}:{self.port}/live/{post_id}"
+
+    def accept(self):
+        while not self.stopping.is_set():
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection: socket.socket):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = connection.recv(4096)
+            if not chunk:
+                connection.close()
+                return
+            request += chunk
+
+        lines = request.decode("latin-1").split("\r\n")
+        post_id = lines[0].split(" ")[1].rsplit("/", 1)[-1]
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(
+            hashlib.sha1((headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()).digest()
+        ).decode()
+        connection.sendall(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+            ).encode()
+        )
+        with self.lock:
+            self.connections[post_id] = connection
+
+        # Nothing the client sends matters, read until it hangs up.
+        try:
+            while connection.recv(4096):
+                pass
+        except OSError:
+            pass
+        with self.lock:
+            if self.connections.get(post_id) is connection:
+                self.connections.pop(post_id)
+        connection.close()
+
+    def connected(self) -> List[str]:
+        with self.lock:
+            return list(self.connections)
+
+    @staticmethod
+    def frame(text: str) -> bytes:
+        payload = text.encode()
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x81, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x81, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x81, 127, length)
+        return header + payload
+
+    def send_comment(self, post_id: str, comment_id: str, author: str, body: str) -> bool:
+        # Shaped like the new_comment frames FrameDecoder parses.
+        return self.send(
+            post_id,
+            json.dumps(
+                {
+                    "type": "new_comment",
+                    "payload": {
+                        "_id36": comment_id,
+                        "author": author,
+                        "body": body,
+                        "link_id": f"t3_{post_id}",
+                        "created_utc": time.time(),
+                    },
+                }
+            ),
+        )
+
+    def send_deletion(self, post_id: str, comment_id: str) -> bool:
+        # One of the frame types the bot has no use for, which the decoder should skip cheaply.
+        return self.send(
+            post_id, json.dumps({"type": "delete_comment", "payload": {"_id36": comment_id}})
+        )
+
+    def send(self, post_id: str, text: str) -> bool:
+        frame = self.frame(text)
+        with self.lock:
+            connection = self.connections.get(post_id)
+            if connection is None:
+                return False
+            try:
+                connection.sendall(frame)
+            except OSError:
+                return False
+            self.frames_sent += 1
+        return True
+
+    def close(self):
+        self.stopping.set()
+        self.listener.close()
+        with self.lock:
+            for connection in self.connections.values():
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.connections.clear()
+
+
+class FakeStrapi:
+    # Answers videos/<fullname> lookups with the fake live comment server's address.
+    def __init__(self, live_comments: FakeLiveCommentServer, host: str = "127.0.0.1"):
+        self.lookups = 0
+        strapi = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                strapi.lookups += 1
+                fullname = self.path.rsplit("/", 1)[-1]
+                body = json.dumps(
+                    {
+                        "data": {
+                            "post": {
+                                "liveCommentsWebsocket": live_comments.address(
+                                    fullname[len("t3_") :]
+                                )
+                            }
+                        }
+                    }
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}/videos/"
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="fake-strapi", daemon=True
+        )
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeRedditor:
+    def __init__(self, reddit: "FakeReddit", name: str):
+        self.reddit = reddit
+        self.name = name
+        self.id = base36(abs(hash(name)) % 36 ** 6)
+
+    def message(self, subject: str, message: str):
+        self.reddit.record("messages")
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeComment:
+    kind = "t1"
+
+    def __init__(self, reddit: "FakeReddit", comment_id: str):
+        self.reddit = reddit
+        self.id = comment_id
+
+    @property
+    def fullname(self) -> str:
+        return f"{self.kind}_{self.id}"
+
+    def reply(self, body: str):
+        self.reddit.record_reply(self.id)
+
+
+class FakeMessage(FakeComment):
+    kind = "t4"
+
+    def __init__(self, reddit: "FakeReddit", message_id: str, author: str, body: str):
+        FakeComment.__init__(self, reddit, message_id)
+        self.author = FakeRedditor(reddit, author)
+        self.body = body
+
+
+class FakeSubredditStream:
+    def submissions(self, pause_after: Optional[int] = None, skip_existing: bool = False):
+        while True:
+            yield None
+
+
+class FakeSubreddit:
+    def __init__(self, name: str):
+        self.display_name = name
+        self.stream = FakeSubredditStream()
+
+    def comments(self, limit: int = 100) -> Iterator[FakeComment]:
+        return iter([])
+
+    def __str__(self) -> str:
+        return self.display_name
+
+
+class FakeCommentForest:
+    def list(self) -> List[FakeComment]:
+        return []
+
+
+class FakeSubmission:
+    def __init__(self, submission_id: str):
+        self.id = submission_id
+        self.fullname = f"t3_{submission_id}"
+        self.allow_live_comments = True
+        self.subreddit = FakeSubreddit("RedditSessions")
+        self.title = f"Fake stream {submission_id}"
+        self.shortlink = f"https://redd.it/{submission_id}"
+        self.comments = FakeCommentForest()
+
+
+class FakeInbox:
+    def __init__(self):
+        self.pending: List[FakeMessage] = []
+        self.lock = threading.Lock()
+
+    def push(self, message: FakeMessage):
+        with self.lock:
+            self.pending.append(message)
+
+    def stream(self, pause_after: Optional[int] = None, skip_existing: bool = False):
+        while True:
+            with self.lock:
+                messages, self.pending = self.pending, []
+            yield from messages
+            yield None
+
+
+class FakeUser:
+    def __init__(self, reddit: "FakeReddit", name: str):
+        self.redditor = FakeRedditor(reddit, name)
+
+    def me(self) -> FakeRedditor:
+        return self.redditor
+
+
+class FakeAuthorizer:
+    access_token = "fake-access-token"
+
+
+class FakeCore:
+    _authorizer = FakeAuthorizer()
+
+
+class FakeReddit:
+    # The slice of praw.Reddit the bot touches, recording when each reply went out.
+    def __init__(self, bot_name: str = "fake_bot"):
+        self.user = FakeUser(self, bot_name)
+        self.inbox = FakeInbox()
+        self._authorized_core = FakeCore()
+
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+        self.replied_at: Dict[str, float] = {}
+        self.message_ids = itertools.count()
+
+    def submission(self, submission_id: str) -> FakeSubmission:
+        return FakeSubmission(submission_id)
+
+    def comment(self, comment_id: str) -> FakeComment:
+        return FakeComment(self, comment_id)
+
+    def redditor(self, name: str) -> FakeRedditor:
+        return FakeRedditor(self, name)
+
+    def subreddit(self, name: str) -> FakeSubreddit:
+        return FakeSubreddit(name)
+
+    def post(self, path: str, data: Dict[str, str]):
+        # Only comment replies come through here, see OutboundDispatcher.send_reply.
+        self.record_reply(data["thing_id"].split("_", 1)[1])
+
+    def push_inbox(self, author: str, body: str) -> str:
+        message_id = f"m{base36(next(self.message_ids))}"
+        self.inbox.push(FakeMessage(self, message_id, author, body))
+        return message_id
+
+    def record(self, name: str):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def record_reply(self, comment_id: str):
+        replied_at = time.monotonic()
+        with self.lock:
+            self.counts["replies"] = self.counts.get("replies", 0) + 1
+            self.replied_at.setdefault(comment_id, replied_at)
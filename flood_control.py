@@ -0,0 +1,78 @@
+from typing import Dict
+from collections import OrderedDict
+import logging
+
+from outbound import TokenBucket
+
+logger = logging.getLogger("bot.flood_control")
+
+
+class AuthorBuckets:
+    __slots__ = ("overall", "commands")
+
+    def __init__(self, rate: float, burst: int):
+        self.overall = TokenBucket(rate, burst)
+        self.commands: Dict[str, TokenBucket] = {}
+
+
+class FloodControl:
+    def __init__(
+        self,
+        enabled: bool = True,
+        rate: float = 0.2,
+        burst: int = 5,
+        command_rate: float = 0.1,
+        command_burst: int = 3,
+        max_authors: int = 4096,
+    ):
+        self.enabled = enabled
+        self.rate = rate
+        self.burst = burst
+        self.command_rate = command_rate
+        self.command_burst = command_burst
+        # Least recently seen authors are dropped first, they'd have refilled by now anyway.
+        self.max_authors = max_authors
+        self.authors: "OrderedDict[str, AuthorBuckets]" = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+        self.evicted = 0
+
+    def allow(self, author: str, command: str) -> bool:
+        if not self.enabled:
+            return True
+
+        buckets = self.authors.get(author)
+        if buckets is None:
+            buckets = self.authors[author] = AuthorBuckets(self.rate, self.burst)
+            if len(self.authors) > self.max_authors:
+                self.authors.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.authors.move_to_end(author)
+
+        command_bucket = buckets.commands.get(command)
+        if command_bucket is None:
+            command_bucket = buckets.commands[command] = TokenBucket(
+                self.command_rate, self.command_burst
+            )
+
+        # The command's own bucket is checked first, so a spammed command doesn't also drain the
+        # author's allowance for everything else.
+        if command_bucket.take():
+            self.limited += 1
+            return False
+        if buckets.overall.take():
+            # Nothing ran, so the command's token goes back.
+            command_bucket.refund()
+            self.limited += 1
+            return False
+        self.allowed += 1
+        return True
+
+    def report(self) -> Dict:
+        return {
+            "authors": len(self.authors),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "evicted": self.evicted,
+        }
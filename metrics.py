@@ -0,0 +1,271 @@
+from typing import Optional, Dict, List, Tuple, Callable, Iterable
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from functools import wraps
+import threading
+import bisect
+import logging
+import time
+
+import prawcore
+
+logger = logging.getLogger("bot.metrics")
+
+# Seconds, from a cheap dict lookup up to a praw call that hit a slow Reddit.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# (name, type, help, labels, value) as read from a collector at scrape time.
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class Counter:
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in values:
+            lines.append(
+                f"{self.name}{format_labels(dict(zip(self.labelnames, labels)))} {value}"
+            )
+        return lines
+
+
+class HistogramTimer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class NullTimer:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Histogram:
+    def __init__(
+        self,
+        registry: "MetricsRegistry",
+        name: str,
+        help: str,
+        labelnames=(),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        # Per label set: [count per bucket (+Inf last), sum]
+        self.values: Dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        if not self.registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *labels: str):
+        # Shared no-op while disabled, so an unscraped bot doesn't allocate per call.
+        if not self.registry.enabled:
+            return NULL_TIMER
+        return HistogramTimer(self, labels)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = [(labels, list(entry[0]), entry[1]) for labels, entry in self.values.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total in values:
+            labels = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = format_labels(dict(labels, le=le))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+def timed(histogram: Histogram, *labels: str):
+    def decorator(func: Callable):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not histogram.registry.enabled:
+                return func(*args, **kwargs)
+            with HistogramTimer(histogram, labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.enabled = False
+        self.metrics: List = []
+        self.collectors: Dict[str, Callable[[], Iterable[Sample]]] = {}
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        metric = Counter(self, name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(self, name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self, name: str, collector: Callable[[], Iterable[Sample]]):
+        # Read at scrape time, for state the components already keep for their report().
+        self.collectors[name] = collector
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        grouped: Dict[str, Tuple[str, str, List[str]]] = {}
+        for name, collector in list(self.collectors.items()):
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector {name} excepted {e}")
+                continue
+            for sample_name, sample_type, help, labels, value in samples:
+                entry = grouped.setdefault(sample_name, (sample_type, help, []))
+                entry[2].append(f"{sample_name}{format_labels(labels)} {float(value)}")
+        for sample_name, (sample_type, help, sample_lines) in grouped.items():
+            lines.append(f"# HELP {sample_name} {help}")
+            lines.append(f"# TYPE {sample_name} {sample_type}")
+            lines.extend(sample_lines)
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host: str = "127.0.0.1", port: int = 9108):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.enabled = True
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="bot-metrics", daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{self.server.server_address[1]}/metrics")
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+REGISTRY = MetricsRegistry()
+
+LOOP_SECONDS = REGISTRY.histogram(
+    "bot_loop_iteration_seconds", "Time taken by one pass of the synchronous bot loop."
+)
+PHASE_SECONDS = REGISTRY.histogram(
+    "bot_phase_seconds", "Time spent in each stage of the bot loop.", ("phase",)
+)
+COMMANDS = REGISTRY.counter(
+    "bot_commands_total", "Commands dispatched by Commands.check_message.", ("command",)
+)
+FLOOD_LIMITED = REGISTRY.counter(
+    "bot_flood_limited_total", "Commands dropped by per author flood control.", ("command",)
+)
+OUTBOUND_LATENCY = REGISTRY.histogram(
+    "bot_outbound_latency_seconds",
+    "Time from queueing a reply or message to Reddit accepting it.",
+    ("kind",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+PRAW_REQUESTS = REGISTRY.counter(
+    "bot_praw_requests_total", "HTTP requests praw made to Reddit.", ("method", "status")
+)
+STREAM_TRANSITIONS = REGISTRY.counter(
+    "bot_stream_transitions_total",
+    "Live comment socket state changes.",
+    ("from", "to"),
+)
+FIRST_FRAME_SECONDS = REGISTRY.histogram(
+    "bot_stream_first_frame_seconds",
+    "Time from a stream going live to its socket's first frame.",
+    ("since",),
+    buckets=(0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+SAVE_JSON_WRITES = REGISTRY.counter(
+    "bot_save_json_writes_total", "JSON state files written.", ("file",)
+)
+SAVE_JSON_BYTES = REGISTRY.counter(
+    "bot_save_json_bytes_total", "Bytes of JSON state written.", ("file",)
+)
+
+
+class CountingRequestor(prawcore.Requestor):
+    # Handed to praw.Reddit as requestor_class, sees every request praw sends.
+    def request(self, *args, **kwargs):
+        try:
+            response = super().request(*args, **kwargs)
+        except prawcore.RequestException:
+            PRAW_REQUESTS.inc(str(args[0]).upper() if args else "", "error")
+            raise
+        PRAW_REQUESTS.inc(str(args[0]).upper() if args else "", str(response.status_code))
+        return response
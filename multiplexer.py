@@ -0,0 +1,160 @@
+from typing import Optional, Dict, List, Tuple
+import threading
+import selectors
+import logging
+import math
+import time
+
+import websocket
+
+logger = logging.getLogger("bot.multiplexer")
+
+
+class SocketStats:
+    # Frame rate is an exponentially decaying count, so a stream that goes quiet cools off.
+    rate_window = 60.0
+
+    def __init__(self):
+        self.connected_at = time.time()
+        self.frames = 0
+        self.first_frame: Optional[float] = None
+        self.last_frame: Optional[float] = None
+        self._rate = 0.0
+
+    def record(self, now: float):
+        if self.last_frame is not None:
+            self._rate *= math.exp(-(now - self.last_frame) / self.rate_window)
+        self._rate += 1 / self.rate_window
+        if self.first_frame is None:
+            self.first_frame = now
+        self.last_frame = now
+        self.frames += 1
+
+    def rate(self, now: float) -> float:
+        if self.last_frame is None:
+            return 0.0
+        return self._rate * math.exp(-(now - self.last_frame) / self.rate_window)
+
+    def idle(self, now: float) -> float:
+        return now - (self.last_frame if self.last_frame is not None else self.connected_at)
+
+
+class SocketMultiplexer:
+    def __init__(self, frame_timeout: float = 0.5):
+        self.frame_timeout = frame_timeout
+        self.selector = selectors.DefaultSelector()
+        self.sockets: Dict[str, websocket.WebSocket] = {}
+        self.raw_sockets: Dict[str, object] = {}
+        self.stats: Dict[str, SocketStats] = {}
+        self.lock = threading.Lock()
+
+    def register(self, post_id: str, this_socket: websocket.WebSocket):
+        # The timeout only bounds reading the rest of a frame once the selector says it started.
+        this_socket.settimeout(self.frame_timeout)
+        with self.lock:
+            if post_id in self.sockets:
+                self._unregister(post_id)
+            self.selector.register(this_socket.sock, selectors.EVENT_READ, post_id)
+            self.sockets[post_id] = this_socket
+            self.raw_sockets[post_id] = this_socket.sock
+            self.stats[post_id] = SocketStats()
+
+    def unregister(self, post_id: str):
+        with self.lock:
+            self._unregister(post_id)
+
+    def _unregister(self, post_id: str):
+        this_socket = self.sockets.pop(post_id, None)
+        raw_socket = self.raw_sockets.pop(post_id, None)
+        stats = self.stats.pop(post_id, None)
+        if this_socket is None:
+            return
+        try:
+            # websocket-client drops .sock on close, so unregister the object we registered.
+            self.selector.unregister(raw_socket)
+        except (KeyError, ValueError):
+            pass
+        if stats is not None:
+            logger.debug(
+                f"Socket for {post_id} unregistered after {stats.frames} frames, idle {stats.idle(time.time()):.1f}s."
+            )
+
+    @staticmethod
+    def _pending(this_socket: websocket.WebSocket) -> bool:
+        # SSL sockets can hold already decrypted bytes the selector can't see.
+        raw_socket = this_socket.sock
+        return (
+            raw_socket is not None and hasattr(raw_socket, "pending") and raw_socket.pending() > 0
+        )
+
+    def poll(self, timeout: float) -> Tuple[List[Tuple[str, str]], List[str]]:
+        return self.read(self.wait(timeout))
+
+    def wait(self, timeout: float) -> List[str]:
+        # Only blocks, so callers can time the wait apart from the reading.
+        with self.lock:
+            sockets = list(self.sockets.items())
+
+        if not sockets:
+            time.sleep(timeout)
+            return []
+
+        ready = [post_id for post_id, this_socket in sockets if self._pending(this_socket)]
+        if ready:
+            return ready
+        try:
+            return [key.data for key, _ in self.selector.select(timeout)]
+        except (OSError, ValueError) as e:
+            # A socket closed from another thread between the snapshot and the select.
+            logger.debug(f"Socket select excepted {e}")
+            return []
+
+    def read(self, ready: List[str]) -> Tuple[List[Tuple[str, str]], List[str]]:
+        frames = []
+        closed = []
+        now = time.time()
+        for post_id in ready:
+            this_socket = self.sockets.get(post_id)
+            if this_socket is None:
+                continue
+            while True:
+                try:
+                    socket_json = this_socket.recv()
+                except websocket.WebSocketTimeoutException:
+                    break
+                except Exception as e:
+                    logger.error(f"Socket for post {post_id} excepted {e}")
+                    closed.append(post_id)
+                    break
+
+                if not this_socket.connected:
+                    closed.append(post_id)
+                    break
+                if socket_json:
+                    stats = self.stats.get(post_id)
+                    if stats is not None:
+                        stats.record(now)
+                    frames.append((post_id, socket_json))
+                if not self._pending(this_socket):
+                    break
+
+        for post_id in closed:
+            self.unregister(post_id)
+        return frames, closed
+
+    def first_frame(self, post_id: str) -> Optional[float]:
+        with self.lock:
+            stats = self.stats.get(post_id)
+            return None if stats is None else stats.first_frame
+
+    def report(self) -> Dict[str, Dict]:
+        now = time.time()
+        with self.lock:
+            return {
+                post_id: {
+                    "frames": stats.frames,
+                    "rate": stats.rate(now),
+                    "idle": stats.idle(now),
+                }
+                for post_id, stats in self.stats.items()
+            }
@@ -0,0 +1,217 @@
+from typing import Optional, Dict, List, Callable
+import itertools
+import threading
+import logging
+import queue
+import math
+import time
+
+import praw
+from praw.const import API_PATH
+
+import metrics
+import utils
+
+logger = logging.getLogger("bot.outbound")
+
+REPLY = 0
+DIRECT_MESSAGE = 1
+KINDS = {REPLY: "reply", DIRECT_MESSAGE: "direct_message"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
+        # Returns 0 when a token was taken, otherwise how long to wait before asking again.
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+class OutboundAction:
+    def __init__(self, priority: int, description: str, func: Callable, args, kwargs):
+        self.priority = priority
+        self.description = description
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.queued_at = time.time()
+
+
+class OutboundDispatcher:
+    rate_window = 60.0
+
+    def __init__(
+        self,
+        reddit_factory: Callable[[], praw.Reddit],
+        rate: float = 1.0,
+        burst: int = 5,
+        workers: int = 2,
+        max_retries: int = 3,
+    ):
+        # praw isn't thread safe, its rate limiter and token refresh are unlocked, so every
+        # worker builds its own instance rather than sharing the state thread's.
+        self.reddit_factory = reddit_factory
+        self.bucket = TokenBucket(rate, burst)
+        self.worker_count = workers
+        self.max_retries = max_retries
+
+        self.queue: queue.PriorityQueue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.workers: List[threading.Thread] = []
+        self.stopping = threading.Event()
+
+        self.stats_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.ratelimited = 0
+        self.last_sent: Optional[float] = None
+        self._drain_rate = 0.0
+
+    def start(self):
+        for worker_number in range(self.worker_count):
+            worker = threading.Thread(
+                target=self.work, name=f"bot-outbound-{worker_number}", daemon=True
+            )
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, priority: int, description: str, func: Callable, *args, **kwargs):
+        action = OutboundAction(priority, description, func, args, kwargs)
+        self.queue.put((priority, next(self.counter), action, 0))
+
+    def reply(self, message, reply: str):
+        # Only the fullname crosses threads, the praw object belongs to the state thread.
+        self.submit(REPLY, f"reply to {message}", self.send_reply, message.fullname, reply)
+
+    def direct_message(self, redditor_name: str, subject: str, message: str):
+        self.submit(
+            DIRECT_MESSAGE,
+            f"message to u/{redditor_name}",
+            self.send_direct_message,
+            redditor_name,
+            subject=subject,
+            message=message,
+        )
+
+    @staticmethod
+    def send_reply(reddit: praw.Reddit, fullname: str, reply: str):
+        # The request praw's reply() makes, on this worker's own instance.
+        reddit.post(API_PATH["comment"], data={"text": reply, "thing_id": fullname})
+
+    @staticmethod
+    def send_direct_message(reddit: praw.Reddit, redditor_name: str, subject: str, message: str):
+        reddit.redditor(redditor_name).message(subject=subject, message=message)
+
+    def work(self):
+        reddit = self.reddit_factory()
+        while not self.stopping.is_set():
+            try:
+                priority, order, action, attempts = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            try:
+                self.send(reddit, priority, order, action, attempts)
+            except Exception as e:
+                # Nothing may kill a worker, a dead one leaves everything queued forever.
+                self.record_failed()
+                logger.error(f"Outbound worker excepted {e!r} handling {action.description}")
+            finally:
+                self.queue.task_done()
+
+    def send(
+        self, reddit: praw.Reddit, priority: int, order: int, action: OutboundAction, attempts: int
+    ):
+        wait = self.bucket.take()
+        while wait:
+            time.sleep(wait)
+            wait = self.bucket.take()
+
+        try:
+            action.func(reddit, *action.args, **action.kwargs)
+            self.record_sent()
+            metrics.OUTBOUND_LATENCY.observe(
+                time.time() - action.queued_at, KINDS.get(priority, str(priority))
+            )
+            logger.debug(
+                f"Sent {action.description} after {time.time() - action.queued_at:.2f}s in queue."
+            )
+        except praw.exceptions.RedditAPIException as api_exception:
+            errors = {error.error_type: error.message for error in api_exception.items}
+            if "RATELIMIT" in errors and attempts < self.max_retries:
+                sleep = utils.ratelimit_sleep(errors["RATELIMIT"])
+                self.bucket.pause(sleep)
+                with self.stats_lock:
+                    self.ratelimited += 1
+                logger.warning(
+                    f"Rate Limit hit sending {action.description}, pausing outbound for {sleep} seconds."
+                )
+                # Keeps its place in the queue so replies still go before bulk messages.
+                self.queue.put((priority, order, action, attempts + 1))
+            else:
+                self.record_failed()
+                logger.error(f"Failed sending {action.description}: {errors}")
+        except Exception as e:
+            self.record_failed()
+            logger.error(f"Failed sending {action.description}: {e}")
+
+    def record_sent(self):
+        now = time.time()
+        with self.stats_lock:
+            if self.last_sent is not None:
+                self._drain_rate *= math.exp(-(now - self.last_sent) / self.rate_window)
+            self._drain_rate += 1 / self.rate_window
+            self.last_sent = now
+            self.sent += 1
+
+    def record_failed(self):
+        with self.stats_lock:
+            self.failed += 1
+
+    def report(self) -> Dict:
+        now = time.time()
+        with self.stats_lock:
+            drain_rate = 0.0
+            if self.last_sent is not None:
+                drain_rate = self._drain_rate * math.exp(-(now - self.last_sent) / self.rate_window)
+            return {
+                "depth": self.queue.qsize(),
+                "sent": self.sent,
+                "failed": self.failed,
+                "ratelimited": self.ratelimited,
+                "drain_rate": drain_rate,
+            }
+
+    def shutdown(self, timeout: float = 10.0):
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.1)
+        if self.queue.unfinished_tasks:
+            logger.warning(f"Dropping {self.queue.unfinished_tasks} unsent outbound actions.")
+        self.stopping.set()
+        for worker in self.workers:
+            worker.join(timeout=1.0)
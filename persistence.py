@@ -0,0 +1,57 @@
+from typing import Optional, Dict, Set, Tuple, Callable
+from pathlib import Path
+import logging
+import time
+
+import utils
+
+logger = logging.getLogger("bot.persistence")
+
+
+class WriteBehind:
+    def __init__(self, interval: float = 2.0):
+        self.interval = interval
+        self.sources: Dict[str, Tuple[Path, Callable[[], Dict]]] = {}
+        self.dirty: Set[str] = set()
+        self.dirty_since: Optional[float] = None
+        self.writes = 0
+        self.coalesced = 0
+
+    def register(self, name: str, json_path: Path, getter: Callable[[], Dict]):
+        # The getter is called at write time, so reassigning e.g. Bot.users on load is picked up.
+        self.sources[name] = (json_path, getter)
+
+    def mark_dirty(self, name: str):
+        if name not in self.sources:
+            raise KeyError(f"No persisted state named '{name}'")
+        if name in self.dirty:
+            self.coalesced += 1
+            return
+        self.dirty.add(name)
+        if self.dirty_since is None:
+            self.dirty_since = time.monotonic()
+
+    def discard(self, name: str):
+        self.dirty.discard(name)
+        if not self.dirty:
+            self.dirty_since = None
+
+    def flush_due(self):
+        if self.dirty_since is not None and time.monotonic() - self.dirty_since >= self.interval:
+            self.flush()
+
+    def flush(self):
+        for name in sorted(self.dirty):
+            json_path, getter = self.sources[name]
+            try:
+                utils.save_json(json_path, getter())
+                self.writes += 1
+            except Exception as e:
+                # Stays dirty, the next flush tries again.
+                logger.error(f"Failed saving {name} to '{json_path}': {e}")
+                continue
+            self.dirty.discard(name)
+        self.dirty_since = time.monotonic() if self.dirty else None
+
+    def report(self) -> Dict:
+        return {"dirty": sorted(self.dirty), "writes": self.writes, "coalesced": self.coalesced}
@@ -0,0 +1,86 @@
+from typing import Dict, Iterable, Set
+import logging
+import math
+
+logger = logging.getLogger("bot.post_scheduler")
+
+
+class PostSchedule:
+    def __init__(self, now: float, interval: float):
+        self.interval = interval
+        self.next_due = now
+        self.last_checked = now
+        self.last_activity = now
+        self.velocity = 0.0
+
+
+class PostScheduler:
+    def __init__(
+        self,
+        min_interval: float = 5.0,
+        max_interval: float = 600.0,
+        backoff: float = 2.0,
+        velocity_window: float = 300.0,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.velocity_window = velocity_window
+        self.schedules: Dict[str, PostSchedule] = {}
+        self.polls = 0
+        self.skipped = 0
+
+    def due(self, post_ids: Iterable[str], now: float) -> Set[str]:
+        post_ids = set(post_ids)
+        for post_id in list(self.schedules.keys()):
+            if post_id not in post_ids:
+                self.schedules.pop(post_id)
+
+        due_posts = set()
+        for post_id in post_ids:
+            schedule = self.schedules.get(post_id)
+            if schedule is None:
+                schedule = self.schedules[post_id] = PostSchedule(now, self.min_interval)
+            if schedule.next_due <= now:
+                due_posts.add(post_id)
+            else:
+                self.skipped += 1
+        return due_posts
+
+    def record(self, post_id: str, new_comments: int, now: float):
+        schedule = self.schedules.get(post_id)
+        if schedule is None:
+            schedule = self.schedules[post_id] = PostSchedule(now, self.min_interval)
+
+        # Comments per minute, decayed over velocity_window so old bursts fade out.
+        decay = math.exp(-(now - schedule.last_checked) / self.velocity_window)
+        schedule.velocity = schedule.velocity * decay + new_comments * 60 / self.velocity_window
+        schedule.last_checked = now
+        self.polls += 1
+
+        if new_comments:
+            # Any new comment means the thread is moving, so it's checked again as soon as allowed.
+            interval = self.min_interval
+            schedule.last_activity = now
+        else:
+            # Quiet polls back off gradually, capped at about one new comment per poll at the
+            # decayed velocity, so a thread that was busy recently isn't left for long.
+            interval = schedule.interval * self.backoff
+            if schedule.velocity > 0:
+                interval = min(interval, 60 / schedule.velocity)
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        if new_comments and interval < schedule.interval:
+            logger.debug(f"Post {post_id} picking up, polling every {interval:.0f}s.")
+        schedule.interval = interval
+        schedule.next_due = now + schedule.interval
+
+    def report(self) -> Dict[str, Dict]:
+        return {
+            post_id: {
+                "interval": schedule.interval,
+                "velocity": schedule.velocity,
+                "next_due": schedule.next_due,
+                "last_activity": schedule.last_activity,
+            }
+            for post_id, schedule in self.schedules.items()
+        }
@@ -0,0 +1,138 @@
+from typing import Optional, Dict, List, Tuple, Callable
+from concurrent.futures import ThreadPoolExecutor, Future
+import logging
+import time
+
+import requests
+import websocket
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("bot.resolver")
+
+
+class AddressResolver:
+    def __init__(
+        self,
+        user_agent: str,
+        workers: int = 4,
+        timeout: float = 10.0,
+        strapi_url: str = "https://strapi.reddit.com/videos/",
+    ):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.strapi_url = strapi_url
+
+        # One keep-alive session for every lookup, so only the first pays for TCP and TLS.
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bot-resolver")
+        self.in_flight: Dict[str, Future] = {}
+        # Called from a worker thread whenever a lookup finishes, so a waiting loop can poll now.
+        self.on_done: Optional[Callable[[], None]] = None
+
+        self.resolved = 0
+        self.failed = 0
+        self.total_latency = 0.0
+
+    def submit(self, post_id: str, fullname: str, access_token: str, connect: bool = False) -> bool:
+        if post_id in self.in_flight:
+            return False
+        future = self.executor.submit(self.resolve, post_id, fullname, access_token, connect)
+        future.add_done_callback(self.finished)
+        self.in_flight[post_id] = future
+        return True
+
+    def connect(self, post_id: str, websocket_address: str) -> bool:
+        # A connect can take as long as the timeout, so it's never made on the bot's own thread.
+        if post_id in self.in_flight:
+            return False
+        future = self.executor.submit(self.dial, post_id, websocket_address)
+        future.add_done_callback(self.finished)
+        self.in_flight[post_id] = future
+        return True
+
+    def finished(self, future: Future):
+        if self.on_done is not None:
+            self.on_done()
+
+    def resolve(
+        self, post_id: str, fullname: str, access_token: str, connect: bool
+    ) -> Tuple[Optional[str], Optional[float], Optional[websocket.WebSocket], Optional[Exception]]:
+        start = time.monotonic()
+        websocket_address = self.fetch_address(post_id, fullname, access_token)
+        latency = time.monotonic() - start
+        this_socket = None
+        if connect and websocket_address is not None:
+            # Failures are left to the bot, it retries the address through connect.
+            this_socket, _ = self.open_socket(post_id, websocket_address)
+        return websocket_address, latency, this_socket, None
+
+    def dial(
+        self, post_id: str, websocket_address: str
+    ) -> Tuple[Optional[str], Optional[float], Optional[websocket.WebSocket], Optional[Exception]]:
+        this_socket, error = self.open_socket(post_id, websocket_address)
+        return websocket_address, None, this_socket, error
+
+    def open_socket(
+        self, post_id: str, websocket_address: str
+    ) -> Tuple[Optional[websocket.WebSocket], Optional[Exception]]:
+        try:
+            return websocket.create_connection(websocket_address, timeout=self.timeout), None
+        except (websocket.WebSocketException, OSError) as e:
+            logger.debug(f"Socket connect for {post_id} excepted {e}")
+            return None, e
+
+    def fetch_address(self, post_id: str, fullname: str, access_token: str) -> Optional[str]:
+        try:
+            response = self.session.get(
+                f"{self.strapi_url}{fullname}",
+                headers={
+                    "user-agent": self.user_agent,
+                    "authorization": f"Bearer {access_token}",
+                    "Sec-Fetch-Mode": "no-cors",
+                },
+                timeout=self.timeout,
+            )
+            if not response.ok:
+                logger.debug(f"Socket address lookup for {post_id} returned {response.status_code}")
+                return None
+            return response.json()["data"]["post"]["liveCommentsWebsocket"]
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            logger.debug(f"Socket address lookup for {post_id} excepted {e}")
+            return None
+
+    def poll(
+        self,
+    ) -> List[Tuple[str, Optional[str], Optional[websocket.WebSocket], Optional[Exception]]]:
+        # Lookups and connects come back the same way, a connect's error is the one it raised.
+        results = []
+        for post_id, future in list(self.in_flight.items()):
+            if not future.done():
+                continue
+            self.in_flight.pop(post_id)
+            websocket_address, latency, this_socket, error = future.result()
+            if latency is not None:
+                self.total_latency += latency
+                if websocket_address is None:
+                    self.failed += 1
+                else:
+                    self.resolved += 1
+            results.append((post_id, websocket_address, this_socket, error))
+        return results
+
+    def busy(self, post_id: str) -> bool:
+        return post_id in self.in_flight
+
+    def report(self) -> Dict:
+        lookups = self.resolved + self.failed
+        return {
+            "in_flight": len(self.in_flight),
+            "resolved": self.resolved,
+            "failed": self.failed,
+            "average_latency": self.total_latency / lookups if lookups else 0.0,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
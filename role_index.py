@@ -0,0 +1,35 @@
+from typing import Dict, FrozenSet, Iterable, Mapping
+import logging
+
+logger = logging.getLogger("bot.role_index")
+
+NO_ROLES: FrozenSet[str] = frozenset()
+
+
+class RoleIndex:
+    def __init__(self):
+        self.user_roles: Dict[str, FrozenSet[str]] = {}
+
+    def rebuild(self, users: Mapping[str, Iterable[str]]):
+        user_roles: Dict[str, set] = {}
+        for role, user_names in users.items():
+            for user_name in user_names:
+                user_roles.setdefault(user_name, set()).add(role)
+        self.user_roles = {user_name: frozenset(roles) for user_name, roles in user_roles.items()}
+        logger.debug(f"Rebuilt role index for {len(self.user_roles)} users.")
+
+    def add(self, user_name: str, role: str):
+        self.user_roles[user_name] = self.roles_of(user_name) | {role}
+
+    def remove(self, user_name: str, role: str):
+        roles = self.roles_of(user_name) - {role}
+        if roles:
+            self.user_roles[user_name] = roles
+        else:
+            self.user_roles.pop(user_name, None)
+
+    def roles_of(self, user_name: str) -> FrozenSet[str]:
+        return self.user_roles.get(user_name, NO_ROLES)
+
+    def has(self, user_name: str, role: str) -> bool:
+        return role in self.user_roles.get(user_name, NO_ROLES)
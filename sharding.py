@@ -0,0 +1,140 @@
+from typing import Optional, Dict, List, Callable
+from pathlib import Path
+import multiprocessing
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger("bot.sharding")
+
+
+class ShardView:
+    def __init__(self, index: int = 0, count: int = 1, alive=None):
+        self.index = index
+        self.count = count
+        # Shared with the supervisor, a non zero entry marks that shard as up and serving.
+        self.alive = alive
+
+    def alive_shards(self) -> List[int]:
+        if self.alive is None:
+            return list(range(self.count))
+        return [index for index in range(self.count) if self.alive[index] or index == self.index]
+
+    @staticmethod
+    def weight(index: int, post_id: str) -> int:
+        # Stable across processes, unlike hash(), every shard has to agree on the answer.
+        digest = hashlib.blake2b(f"{index}:{post_id}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def owner_of(self, post_id: str) -> int:
+        # Rendezvous hashing, a shard dying only moves the streams it owned.
+        return max(self.alive_shards(), key=lambda index: self.weight(index, post_id))
+
+    def owns(self, post_id: str) -> bool:
+        return self.count == 1 or self.owner_of(post_id) == self.index
+
+    def mark_alive(self):
+        # Set by the worker itself once it's ready to serve, the supervisor only ever clears it.
+        if self.alive is not None:
+            self.alive[self.index] = 1
+
+    def is_leader(self) -> bool:
+        # The lowest live shard runs the praw feeds and post polling, so each only runs once.
+        return self.alive_shards()[0] == self.index
+
+
+class Supervisor:
+    def __init__(
+        self,
+        worker_target: Callable,
+        script_dir: Path,
+        config_dir: Path,
+        config: Dict,
+        workers: int = 4,
+        respawn_delay: float = 5.0,
+        check_interval: float = 1.0,
+    ):
+        self.worker_target = worker_target
+        self.script_dir = script_dir
+        self.config_dir = config_dir
+        self.config = config
+        self.worker_count = workers
+        self.respawn_delay = respawn_delay
+        self.check_interval = check_interval
+
+        # Spawned rather than forked, so each worker starts its own logging and webhook threads.
+        self.context = multiprocessing.get_context("spawn")
+        self.alive = self.context.Array("b", workers, lock=False)
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self.respawn_at: Dict[int, float] = {}
+        self.respawns = 0
+
+    def start_worker(self, index: int):
+        process = self.context.Process(
+            target=self.worker_target,
+            args=(
+                self.script_dir,
+                self.config_dir,
+                self.config,
+                index,
+                self.worker_count,
+                self.alive,
+            ),
+            name=f"bot-shard-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Started shard {index} of {self.worker_count} as pid {process.pid}")
+
+    def check_workers(self):
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if index in self.respawn_at:
+                if now >= self.respawn_at[index]:
+                    self.respawn_at.pop(index)
+                    self.respawns += 1
+                    self.start_worker(index)
+                continue
+            if process is not None and not process.is_alive():
+                # Marked dead straight away so the other shards pick its streams up while it waits.
+                self.alive[index] = 0
+                self.respawn_at[index] = now + self.respawn_delay
+                logger.error(
+                    f"Shard {index} exited with {process.exitcode}, "
+                    f"respawning in {self.respawn_delay} seconds."
+                )
+
+    def run(self):
+        if self.config.get("storage", {}).get("backend") != "sqlite":
+            raise ValueError("Sharded mode needs the sqlite storage backend to share state.")
+
+        for index in range(self.worker_count):
+            self.start_worker(index)
+        try:
+            while True:
+                time.sleep(self.check_interval)
+                self.check_workers()
+        finally:
+            self.shutdown()
+
+    def report(self) -> Dict:
+        return {
+            "workers": self.worker_count,
+            "alive": [index for index in range(self.worker_count) if self.alive[index]],
+            "respawns": self.respawns,
+        }
+
+    def shutdown(self, timeout: float = 15.0):
+        # SIGTERM asks each worker to shut down cleanly, one stopped by Ctrl+C ignores it.
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=max(0.0, deadline - time.monotonic()))
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                logger.warning(f"Shard {index} didn't stop in time, killing it.")
+                process.kill()
+                process.join(timeout=1.0)
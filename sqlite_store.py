@@ -0,0 +1,305 @@
+from typing import Optional, Dict, List, Iterator, Tuple, Any
+from collections.abc import Mapping, MutableMapping
+from pathlib import Path
+import threading
+import argparse
+import logging
+import sqlite3
+import json
+
+import utils
+
+logger = logging.getLogger("bot.sqlite_store")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roles (
+    role TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS role_members (
+    role TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    PRIMARY KEY (role, user_name)
+);
+CREATE INDEX IF NOT EXISTS role_members_user ON role_members (user_name);
+CREATE TABLE IF NOT EXISTS monitored_posts (
+    post_id TEXT PRIMARY KEY,
+    cursor TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS monitored_streams (
+    status TEXT NOT NULL,
+    post_id TEXT NOT NULL,
+    address TEXT,
+    PRIMARY KEY (status, post_id)
+);
+CREATE TABLE IF NOT EXISTS feed_positions (
+    feed TEXT PRIMARY KEY,
+    last_created REAL NOT NULL,
+    fullname TEXT NOT NULL
+);
+"""
+
+DEFAULT_ROLES = ("admins", "moderators", "subscribers")
+STREAM_STATUSES = ("monitored", "unmonitored")
+
+
+class SqliteStore:
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        # Autocommit, every mutation is its own small upsert. The lock serialises the threads
+        # (state thread, outbound workers) sharing the connection.
+        self.connection = sqlite3.connect(
+            str(db_path), isolation_level=None, check_same_thread=False
+        )
+        self.lock = threading.RLock()
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO roles (role) VALUES (?)", [(role,) for role in DEFAULT_ROLES]
+            )
+
+        self.users = UsersView(self)
+        self.monitored_posts = PostsView(self)
+        self.monitored_streams = StreamsView(self)
+
+    def execute(self, query: str, parameters=()) -> List[tuple]:
+        with self.lock:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def data_version(self) -> int:
+        # Changes whenever another connection commits, cheap enough to check every loop.
+        return self.execute("PRAGMA data_version")[0][0]
+
+    def feed_position(self, feed: str) -> Optional[Tuple[float, str]]:
+        # The newest item the leading shard has handled, so a new leader picks up after it.
+        rows = self.execute(
+            "SELECT last_created, fullname FROM feed_positions WHERE feed = ?", (feed,)
+        )
+        return rows[0] if rows else None
+
+    def set_feed_position(self, feed: str, last_created: float, fullname: str):
+        self.execute(
+            "INSERT INTO feed_positions (feed, last_created, fullname) VALUES (?, ?, ?) "
+            "ON CONFLICT (feed) DO UPDATE SET "
+            "last_created = excluded.last_created, fullname = excluded.fullname",
+            (feed, last_created, fullname),
+        )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class RoleMembers:
+    def __init__(self, store: SqliteStore, role: str):
+        self.store = store
+        self.role = role
+
+    def __contains__(self, user_name: Any) -> bool:
+        return bool(
+            self.store.execute(
+                "SELECT 1 FROM role_members WHERE role = ? AND user_name = ?",
+                (self.role, user_name),
+            )
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self.store.execute(
+            "SELECT user_name FROM role_members WHERE role = ? ORDER BY rowid", (self.role,)
+        )
+        return iter([user_name for (user_name,) in rows])
+
+    def __len__(self) -> int:
+        return self.store.execute("SELECT COUNT(*) FROM role_members WHERE role = ?", (self.role,))[
+            0
+        ][0]
+
+    def append(self, user_name: str):
+        self.store.execute(
+            "INSERT OR IGNORE INTO role_members (role, user_name) VALUES (?, ?)",
+            (self.role, user_name),
+        )
+
+    def remove(self, user_name: str):
+        with self.store.lock:
+            cursor = self.store.connection.execute(
+                "DELETE FROM role_members WHERE role = ? AND user_name = ?", (self.role, user_name)
+            )
+            if not cursor.rowcount:
+                raise ValueError(f"{user_name} not in {self.role}")
+
+    def __repr__(self) -> str:
+        return f"RoleMembers({self.role!r}, {list(self)!r})"
+
+
+class UsersView(Mapping):
+    def __init__(self, store: SqliteStore):
+        self.store = store
+
+    def __getitem__(self, role: str) -> RoleMembers:
+        if not self.store.execute("SELECT 1 FROM roles WHERE role = ?", (role,)):
+            raise KeyError(role)
+        return RoleMembers(self.store, role)
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self.store.execute("SELECT role FROM roles ORDER BY rowid")
+        return iter([role for (role,) in rows])
+
+    def __len__(self) -> int:
+        return self.store.execute("SELECT COUNT(*) FROM roles")[0][0]
+
+    def add_role(self, role: str):
+        self.store.execute("INSERT OR IGNORE INTO roles (role) VALUES (?)", (role,))
+
+    def roles_of(self, user_name: str) -> List[str]:
+        rows = self.store.execute("SELECT role FROM role_members WHERE user_name = ?", (user_name,))
+        return [role for (role,) in rows]
+
+
+class PostsView(MutableMapping):
+    def __init__(self, store: SqliteStore):
+        self.store = store
+
+    def __getitem__(self, post_id: str) -> Any:
+        rows = self.store.execute(
+            "SELECT cursor FROM monitored_posts WHERE post_id = ?", (post_id,)
+        )
+        if not rows:
+            raise KeyError(post_id)
+        return json.loads(rows[0][0])
+
+    def __setitem__(self, post_id: str, cursor: Any):
+        self.store.execute(
+            "INSERT INTO monitored_posts (post_id, cursor) VALUES (?, ?) "
+            "ON CONFLICT (post_id) DO UPDATE SET cursor = excluded.cursor",
+            (post_id, json.dumps(cursor)),
+        )
+
+    def __delitem__(self, post_id: str):
+        with self.store.lock:
+            cursor = self.store.connection.execute(
+                "DELETE FROM monitored_posts WHERE post_id = ?", (post_id,)
+            )
+            if not cursor.rowcount:
+                raise KeyError(post_id)
+
+    def __contains__(self, post_id: Any) -> bool:
+        return bool(
+            self.store.execute("SELECT 1 FROM monitored_posts WHERE post_id = ?", (post_id,))
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self.store.execute("SELECT post_id FROM monitored_posts ORDER BY rowid")
+        return iter([post_id for (post_id,) in rows])
+
+    def __len__(self) -> int:
+        return self.store.execute("SELECT COUNT(*) FROM monitored_posts")[0][0]
+
+
+class StreamStatusView(MutableMapping):
+    def __init__(self, store: SqliteStore, status: str):
+        self.store = store
+        self.status = status
+
+    def __getitem__(self, post_id: str) -> Optional[str]:
+        rows = self.store.execute(
+            "SELECT address FROM monitored_streams WHERE status = ? AND post_id = ?",
+            (self.status, post_id),
+        )
+        if not rows:
+            raise KeyError(post_id)
+        return rows[0][0]
+
+    def __setitem__(self, post_id: str, address: Optional[str]):
+        self.store.execute(
+            "INSERT INTO monitored_streams (status, post_id, address) VALUES (?, ?, ?) "
+            "ON CONFLICT (status, post_id) DO UPDATE SET address = excluded.address",
+            (self.status, post_id, address),
+        )
+
+    def __delitem__(self, post_id: str):
+        with self.store.lock:
+            cursor = self.store.connection.execute(
+                "DELETE FROM monitored_streams WHERE status = ? AND post_id = ?",
+                (self.status, post_id),
+            )
+            if not cursor.rowcount:
+                raise KeyError(post_id)
+
+    def __contains__(self, post_id: Any) -> bool:
+        return bool(
+            self.store.execute(
+                "SELECT 1 FROM monitored_streams WHERE status = ? AND post_id = ?",
+                (self.status, post_id),
+            )
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self.store.execute(
+            "SELECT post_id FROM monitored_streams WHERE status = ? ORDER BY rowid", (self.status,)
+        )
+        return iter([post_id for (post_id,) in rows])
+
+    def __len__(self) -> int:
+        return self.store.execute(
+            "SELECT COUNT(*) FROM monitored_streams WHERE status = ?", (self.status,)
+        )[0][0]
+
+
+class StreamsView(Mapping):
+    def __init__(self, store: SqliteStore):
+        self.store = store
+        self.statuses = {status: StreamStatusView(store, status) for status in STREAM_STATUSES}
+
+    def __getitem__(self, status: str) -> StreamStatusView:
+        return self.statuses[status]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.statuses)
+
+    def __len__(self) -> int:
+        return len(self.statuses)
+
+
+def import_json(store: SqliteStore, config_dir: Path):
+    users = utils.load_json(config_dir / "users.json")
+    monitored_posts = utils.load_json(config_dir / "monitored_posts.json")
+    monitored_streams = utils.load_json(config_dir / "monitored_streams.json")
+
+    with store.lock:
+        store.connection.execute("BEGIN")
+        try:
+            for role, user_names in users.items():
+                store.users.add_role(role)
+                for user_name in user_names:
+                    store.users[role].append(user_name)
+            for post_id, cursor in monitored_posts.items():
+                store.monitored_posts[post_id] = cursor
+            for status in STREAM_STATUSES:
+                for post_id, address in monitored_streams.get(status, {}).items():
+                    store.monitored_streams[status][post_id] = address
+            store.connection.execute("COMMIT")
+        except Exception:
+            store.connection.execute("ROLLBACK")
+            raise
+
+    logger.info(
+        f"Imported {sum(len(user_names) for user_names in users.values())} role memberships, "
+        f"{len(monitored_posts)} posts and "
+        f"{sum(len(streams) for streams in monitored_streams.values())} streams into '{store.db_path}'."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import the JSON state files into the SQLite state store."
+    )
+    parser.add_argument("config_dir", type=Path, help="Directory holding users.json etc.")
+    parser.add_argument(
+        "--db", type=Path, default=None, help="Database path, defaults to <config_dir>/state.db"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    import_json(SqliteStore(args.db or args.config_dir / "state.db"), args.config_dir)
@@ -0,0 +1,121 @@
+from typing import Optional, Dict, List, Sequence
+import logging
+import random
+import time
+
+import websocket
+
+import metrics
+
+logger = logging.getLogger("bot.stream_connection")
+
+RESOLVING = "resolving"
+CONNECTING = "connecting"
+LIVE = "live"
+BACKOFF = "backoff"
+BROWSER_FALLBACK = "browser_fallback"
+ABANDONED = "abandoned"
+STATES = (RESOLVING, CONNECTING, LIVE, BACKOFF, BROWSER_FALLBACK, ABANDONED)
+
+
+class ReconnectPolicy:
+    def __init__(
+        self,
+        base_delay: float = 1.0,
+        factor: float = 2.0,
+        max_delay: float = 30.0,
+        jitter: float = 0.5,
+        browser_after: int = 2,
+        browser_refresh_at: Sequence[int] = (6, 12, 20),
+        abandon_after: int = 30,
+    ):
+        self.base_delay = base_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.browser_after = browser_after
+        self.browser_refresh_at = tuple(browser_refresh_at)
+        self.abandon_after = abandon_after
+
+    def delay(self, failures: int) -> float:
+        # Jittered so streams dropped by the same Reddit hiccup don't all retry in lockstep.
+        delay = min(self.max_delay, self.base_delay * self.factor ** max(0, failures - 1))
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+
+class StreamConnection:
+    def __init__(self, post_id: str, policy: ReconnectPolicy, state: str = RESOLVING):
+        self.post_id = post_id
+        self.policy = policy
+        self.state = state
+        self.socket: Optional[websocket.WebSocket] = None
+        self.failures = 0
+        # Set when the last failure says the saved address itself is no good.
+        self.stale = False
+        self.retry_at = 0.0
+        self.changed_at = time.monotonic()
+        # Wall clock, set for streams this bot saw go live, to time how soon chat arrived.
+        self.went_live_at: Optional[float] = None
+        self.detected_at: Optional[float] = None
+        self.first_frame_at: Optional[float] = None
+
+    def transition(self, state: str, reason: str):
+        if state == self.state:
+            return
+        logger.info(f"Socket for {self.post_id} {self.state} -> {state}: {reason}")
+        metrics.STREAM_TRANSITIONS.inc(self.state, state)
+        self.state = state
+        self.changed_at = time.monotonic()
+
+    def due(self, now: float) -> bool:
+        return self.state in (CONNECTING, BACKOFF, BROWSER_FALLBACK) and self.retry_at <= now
+
+    def needs_address(self) -> bool:
+        # Transient failures retry the saved address, until they add up to the browser step.
+        return self.state == BROWSER_FALLBACK or self.stale
+
+    def connected(self, this_socket: websocket.WebSocket):
+        self.socket = this_socket
+        self.failures = 0
+        self.stale = False
+        self.transition(LIVE, "connected")
+
+    def dropped(self, reason: str):
+        # A stream that was live is retried straight away at the address it was using.
+        self.socket = None
+        self.retry_at = 0.0
+        self.transition(CONNECTING, reason)
+
+    def failed(self, reason: str, now: float, stale: bool = False) -> str:
+        # Returns the browser step the bot should take: "load", "refresh" or "".
+        self.socket = None
+        self.failures += 1
+        self.stale = stale
+        if self.failures >= self.policy.abandon_after:
+            self.transition(ABANDONED, f"{reason}, gave up after {self.failures} failures")
+            return ""
+
+        self.retry_at = now + self.policy.delay(self.failures)
+        reason = f"{reason}, retrying in {self.retry_at - now:.1f}s"
+        if self.failures < self.policy.browser_after:
+            self.transition(BACKOFF, reason)
+            return ""
+        # Loading the stream's page in Chrome is what gets Reddit to hand out a fresh address.
+        self.transition(BROWSER_FALLBACK, reason)
+        if self.failures == self.policy.browser_after:
+            return "load"
+        if self.failures in self.policy.browser_refresh_at:
+            return "refresh"
+        return ""
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+def count_states(connections: List[StreamConnection]) -> Dict[str, int]:
+    counts = dict.fromkeys(STATES, 0)
+    for connection in connections:
+        counts[connection.state] += 1
+    return counts
@@ -0,0 +1,50 @@
+import time
+
+import coalescer
+from envelope import MessageEnvelope
+
+
+class RecordingOutbound:
+    def __init__(self):
+        self.replies = []
+
+    def reply(self, new_message: MessageEnvelope, reply: str):
+        self.replies.append((new_message.author, reply))
+
+
+def message(author: str) -> MessageEnvelope:
+    return MessageEnvelope("!song", author, "stream", "abc")
+
+
+def test_duplicate_is_suppressed_until_the_window_expires():
+    outbound = RecordingOutbound()
+    replies = coalescer.ReplyCoalescer(outbound, window=10.0)
+    assert replies.reply("song", message("first"), "Now playing")
+    assert not replies.reply("song", message("second"), "Now playing")
+    assert outbound.replies == [("first", "Now playing")]
+
+    replies.flush_due(time.monotonic() + 11.0)
+    assert replies.entries == {}
+    assert replies.reply("song", message("third"), "Now playing")
+    assert len(outbound.replies) == 2
+
+
+def test_mentions_are_sent_when_the_window_expires():
+    outbound = RecordingOutbound()
+    replies = coalescer.ReplyCoalescer(outbound, window=10.0, mention_requesters=True)
+    replies.reply("song", message("first"), "Now playing")
+    replies.reply("song", message("second"), "Now playing")
+    assert outbound.replies == []
+
+    replies.flush_due(time.monotonic() + 11.0)
+    assert outbound.replies == [("first", "u/first, u/second: Now playing")]
+
+
+def test_oldest_entry_is_expired_past_max_entries():
+    outbound = RecordingOutbound()
+    replies = coalescer.ReplyCoalescer(outbound, window=10.0, max_entries=2)
+    for key in ("a", "b", "c"):
+        replies.reply(key, message(key), key)
+    assert list(replies.entries) == ["b", "c"]
+    # Expired early, so the same reply can go out again.
+    assert replies.reply("a", message("again"), "a")
@@ -0,0 +1,26 @@
+import flood_control
+import outbound
+
+
+def test_refund_is_capped_at_burst():
+    bucket = outbound.TokenBucket(rate=0.001, burst=2)
+    assert bucket.take() == 0.0
+    bucket.refund()
+    bucket.refund()
+    assert bucket.tokens == 2.0
+
+
+def test_author_limit_refunds_the_command_token():
+    flood = flood_control.FloodControl(rate=0.001, burst=1, command_rate=0.001, command_burst=2)
+    assert flood.allow("viewer", "!song")
+    # The author's overall bucket is empty, so the command's token goes back.
+    assert not flood.allow("viewer", "!song")
+    assert flood.authors["viewer"].commands["!song"].tokens >= 1.0
+    assert flood.report()["limited"] == 1
+
+
+def test_spammed_command_leaves_other_commands_alone():
+    flood = flood_control.FloodControl(rate=0.001, burst=3, command_rate=0.001, command_burst=1)
+    assert flood.allow("viewer", "!song")
+    assert not flood.allow("viewer", "!song")
+    assert flood.allow("viewer", "!help")
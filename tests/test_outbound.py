@@ -0,0 +1,46 @@
+import time
+
+import praw
+import pytest
+
+import outbound
+import utils
+
+
+@pytest.mark.parametrize(
+    "message, sleep",
+    [
+        ("Take a break for 5 minutes before trying again.", 305),
+        ("you are doing that too much. try again in 9 seconds.", 9),
+        ("you are doing that too much. try again in 1 minute.", 65),
+        ("you are doing that too much. try again in 2 hours.", 7260),
+        ("Slow down.", utils.RATELIMIT_FALLBACK),
+    ],
+)
+def test_ratelimit_sleep(message, sleep):
+    assert utils.ratelimit_sleep(message) == sleep
+
+
+def test_worker_survives_unexpected_errors(monkeypatch):
+    def broken_ratelimit_sleep(message):
+        raise ValueError(message)
+
+    def ratelimited(reddit):
+        raise praw.exceptions.RedditAPIException([["RATELIMIT", "Slow down.", None]])
+
+    monkeypatch.setattr(outbound.utils, "ratelimit_sleep", broken_ratelimit_sleep)
+    dispatcher = outbound.OutboundDispatcher(lambda: None, rate=1000.0, burst=10, workers=2)
+    dispatcher.start()
+    try:
+        for _ in range(4):
+            dispatcher.submit(outbound.REPLY, "ratelimited reply", ratelimited)
+        deadline = time.monotonic() + 5.0
+        while dispatcher.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        report = dispatcher.report()
+        assert report["depth"] == 0
+        assert report["failed"] == 4
+        assert all(worker.is_alive() for worker in dispatcher.workers)
+    finally:
+        dispatcher.shutdown(timeout=1.0)
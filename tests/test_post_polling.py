@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+import time
+
+import praw
+
+import bot
+import post_scheduler
+
+
+class ListingComment:
+    def __init__(self, comment_id: str, post_id: str, created_utc: float):
+        self.id = comment_id
+        self.link_id = f"t3_{post_id}"
+        self.created_utc = created_utc
+        # Authorless comments are recorded without running any commands.
+        self.author = None
+        self.body = ""
+
+
+class PollingReddit:
+    def __init__(self, listing, tree):
+        self.listing = listing
+        self.tree = tree
+        self.listed = 0
+        self.tree_fetches = []
+
+    def subreddit(self, name: str):
+        return SimpleNamespace(comments=self.comments)
+
+    def comments(self, limit: int):
+        for comment in self.listing[:limit]:
+            self.listed += 1
+            yield comment
+
+    def submission(self, post_id: str):
+        self.tree_fetches.append(post_id)
+        return SimpleNamespace(comments=SimpleNamespace(list=lambda: list(self.tree)))
+
+
+def polling_bot(reddit: PollingReddit, last_created: float) -> bot.Bot:
+    polling = object.__new__(bot.Bot)
+    polling.reddit = reddit
+    polling.monitored_posts = {
+        "abc": {"subreddit": "RedditSessions", "last_created": last_created, "seen": []}
+    }
+    polling.post_scheduler = post_scheduler.PostScheduler()
+    polling.post_polling_config = {"fetch_limit": 100, "grace": 60.0, "max_seen": 500}
+    polling.posts_scanned_until = {}
+    polling.mark_dirty = lambda update: None
+    return polling
+
+
+def test_listing_stops_at_the_cursor():
+    now = time.time()
+    listing = [ListingComment("new", "abc", now)] + [
+        ListingComment(f"old{index}", "abc", now - 3600 - index) for index in range(50)
+    ]
+    reddit = PollingReddit(listing, [])
+    polling = polling_bot(reddit, now - 600)
+
+    polling.check_posts()
+
+    # The first comment past the cursor and grace ends the scan.
+    assert reddit.listed == 2
+    assert reddit.tree_fetches == []
+    assert polling.monitored_posts["abc"]["seen"] == ["new"]
+    assert polling.posts_scanned_until["abc"] >= now
+
+
+def test_listing_overflow_falls_back_to_the_comment_tree():
+    now = time.time()
+    # A busy neighbour fills the whole page without reaching the cursor.
+    listing = [ListingComment(f"other{index}", "xyz", now - index) for index in range(300)]
+    more = praw.models.MoreComments(
+        None, {"count": 1, "children": [], "id": "more", "name": "t1_more", "parent_id": "t3_abc"}
+    )
+    tree = [ListingComment("missed", "abc", now - 200), more]
+    reddit = PollingReddit(listing, tree)
+    polling = polling_bot(reddit, now - 3600)
+
+    polling.check_posts()
+
+    assert reddit.listed == 100
+    assert reddit.tree_fetches == ["abc"]
+    assert polling.monitored_posts["abc"]["seen"] == ["missed"]
@@ -0,0 +1,29 @@
+from post_scheduler import PostScheduler
+
+
+def test_new_comment_snaps_to_min_interval():
+    scheduler = PostScheduler(min_interval=5.0, max_interval=600.0, backoff=2.0)
+    assert scheduler.due(["abc"], 0.0) == {"abc"}
+
+    scheduler.record("abc", 0, 5.0)
+    assert scheduler.schedules["abc"].interval == 10.0
+
+    scheduler.record("abc", 1, 15.0)
+    assert scheduler.schedules["abc"].interval == 5.0
+    assert scheduler.schedules["abc"].next_due == 20.0
+
+    scheduler.record("abc", 0, 20.0)
+    assert scheduler.schedules["abc"].interval == 10.0
+
+
+def test_busy_thread_backs_off_slowly_once_quiet():
+    scheduler = PostScheduler(min_interval=5.0, max_interval=600.0, backoff=2.0)
+    now = 0.0
+    for _ in range(30):
+        scheduler.record("abc", 3, now)
+        now += 5.0
+    # About 14 comments a minute only a minute ago, so a couple of quiet polls don't back off.
+    for _ in range(2):
+        scheduler.record("abc", 0, now)
+        now += 5.0
+        assert scheduler.schedules["abc"].interval == 5.0
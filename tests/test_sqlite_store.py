@@ -0,0 +1,65 @@
+import pytest
+
+import sqlite_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = sqlite_store.SqliteStore(tmp_path / "state.db")
+    yield store
+    store.close()
+
+
+def test_role_members(store):
+    assert set(store.users) == set(sqlite_store.DEFAULT_ROLES)
+    store.users["admins"].append("alice")
+    store.users["admins"].append("alice")
+    store.users["moderators"].append("alice")
+    assert list(store.users["admins"]) == ["alice"]
+    assert "alice" in store.users["admins"]
+    assert sorted(store.users.roles_of("alice")) == ["admins", "moderators"]
+
+    store.users["admins"].remove("alice")
+    assert "alice" not in store.users["admins"]
+    with pytest.raises(ValueError):
+        store.users["admins"].remove("alice")
+    with pytest.raises(KeyError):
+        store.users["nobody"]
+
+
+def test_post_cursors_round_trip(store):
+    cursor = {"subreddit": "RedditSessions", "last_created": 1.5, "seen": ["c1", "c2"]}
+    store.monitored_posts["abc"] = cursor
+    assert store.monitored_posts["abc"] == cursor
+
+    # Cursors come back as copies, so changing one means storing it again.
+    store.monitored_posts["abc"]["seen"].append("c3")
+    assert store.monitored_posts["abc"]["seen"] == ["c1", "c2"]
+
+    store.monitored_posts["xyz"] = 3
+    assert list(store.monitored_posts) == ["abc", "xyz"]
+    assert len(store.monitored_posts) == 2
+    del store.monitored_posts["abc"]
+    assert "abc" not in store.monitored_posts
+    with pytest.raises(KeyError):
+        del store.monitored_posts["abc"]
+
+
+def test_stream_statuses_are_separate(store):
+    streams = store.monitored_streams
+    streams["monitored"]["abc"] = None
+    streams["monitored"]["abc"] = "wss://example/abc"
+    assert streams["monitored"]["abc"] == "wss://example/abc"
+    assert "abc" not in streams["unmonitored"]
+
+    streams["unmonitored"]["abc"] = streams["monitored"].pop("abc")
+    assert len(streams["monitored"]) == 0
+    assert dict(streams["unmonitored"]) == {"abc": "wss://example/abc"}
+
+
+def test_feed_position(store):
+    assert store.feed_position("inbox") is None
+    store.set_feed_position("inbox", 10.0, "t4_a")
+    store.set_feed_position("inbox", 12.0, "t4_b")
+    assert store.feed_position("inbox") == (12.0, "t4_b")
+    assert store.feed_position("submissions") is None
@@ -0,0 +1,79 @@
+from pathlib import Path
+import argparse
+import tempfile
+import socket
+import time
+
+import pytest
+
+import benchmark
+import bot
+import fakes
+import resolver
+import stream_connection
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def live_bot():
+    live_comments = fakes.FakeLiveCommentServer()
+    strapi = fakes.FakeStrapi(live_comments)
+    with tempfile.TemporaryDirectory() as load_dir:
+        load_dir = Path(load_dir)
+        benchmark.write_load_config(REPO_DIR / "config", load_dir, ["s1"])
+        config = benchmark.load_config(
+            REPO_DIR / "config", strapi.url, argparse.Namespace(reply_rate=100, metrics=False)
+        )
+        config["reconnect"] = {"base_delay": 0.01, "jitter": 0.0}
+        test_bot = bot.Bot(REPO_DIR, load_dir, config, reddit=fakes.FakeReddit())
+        try:
+            yield test_bot, live_comments
+        finally:
+            test_bot.shutdown()
+            strapi.close()
+            live_comments.close()
+
+
+def step_until(test_bot, done, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not done():
+        assert time.monotonic() < deadline, "timed out"
+        test_bot.add_new_sockets()
+        test_bot.check_sockets(0.01)
+
+
+def test_transient_connect_failure_reconnects(live_bot, monkeypatch):
+    test_bot, live_comments = live_bot
+    step_until(
+        test_bot,
+        lambda: "s1" in test_bot.stream_connections
+        and test_bot.stream_connections["s1"].state == stream_connection.LIVE,
+    )
+    connection = test_bot.stream_connections["s1"]
+    assert "s1" in live_comments.connected()
+
+    # The server stays up and the address stays valid, only the first reconnect attempt fails.
+    create_connection = resolver.websocket.create_connection
+    attempts = []
+
+    def flaky_create_connection(*args, **kwargs):
+        attempts.append(kwargs)
+        if len(attempts) == 1:
+            raise ConnectionRefusedError("refused")
+        return create_connection(*args, **kwargs)
+
+    monkeypatch.setattr(resolver.websocket, "create_connection", flaky_create_connection)
+    with live_comments.lock:
+        live_comments.connections["s1"].shutdown(socket.SHUT_RDWR)
+
+    step_until(
+        test_bot,
+        lambda: connection.state == stream_connection.LIVE and len(attempts) >= 2,
+    )
+    assert len(attempts) == 2
+    # Both attempts ran on the resolver's workers, bounded by its timeout.
+    assert all(kwargs["timeout"] == test_bot.resolver.timeout for kwargs in attempts)
+    assert connection.failures == 0
+    assert "s1" in test_bot.monitored_streams["monitored"]
+    assert "s1" not in test_bot.monitored_streams["unmonitored"]
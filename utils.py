@@ -1,12 +1,17 @@
-from typing import Optional, Union, Dict, List
+from typing import Optional, Union, Dict, List, Tuple
 from pathlib import Path
 import logging
 import json
+import re
+import time
+import os
 
 from selenium.webdriver.chrome.options import Options
 from selenium import webdriver
 import discord_webhook
 
+import metrics
+
 logger = logging.getLogger("bot.utils")
 
 
@@ -22,11 +27,62 @@ def load_json(json_path: Path) -> Dict:
         raise Exception(f"Failed loading json at '{json_path}'!")
 
 
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def total(self) -> float:
+        return self.last - self.started
+
+    def report(self) -> str:
+        phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases)
+        return f"{self.total():.2f}s ({phases})"
+
+
+def config_section(config: Dict, name: str, defaults: Dict) -> Dict:
+    section = dict(defaults)
+    section.update(config.get(name, {}))
+    return section
+
+
 def save_json(json_path: Path, save_dict: Union[Dict, List]) -> None:
-    Path(json_path).write_text(json.dumps(save_dict, indent=4, sort_keys=True))
+    # Written next to the target and renamed over it, so a crash never leaves a partial file.
+    json_path = Path(json_path)
+    temp_path = json_path.with_name(json_path.name + ".tmp")
+    data = json.dumps(save_dict, indent=4, sort_keys=True).encode()
+    with open(temp_path, "wb") as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_path, json_path)
+    metrics.SAVE_JSON_WRITES.inc(json_path.name)
+    metrics.SAVE_JSON_BYTES.inc(json_path.name, amount=len(data))
     logger.debug(f"Saved '{json_path}' successfully.")
 
 
+RATELIMIT_DURATION = re.compile(r"(\d+) (hour|minute|second)")
+RATELIMIT_PADDING = {"hour": 60, "minute": 5, "second": 0}
+RATELIMIT_UNITS = {"hour": 3600, "minute": 60, "second": 1}
+# When Reddit words the message in a way none of the above matches.
+RATELIMIT_FALLBACK = 60
+
+
+def ratelimit_sleep(ratelimit_message: str) -> int:
+    # e.g. "Take a break for 5 minutes before trying again." or "... try again in 9 seconds."
+    matches = RATELIMIT_DURATION.findall(ratelimit_message)
+    if not matches:
+        return RATELIMIT_FALLBACK
+    sleep = sum(int(amount) * RATELIMIT_UNITS[unit] for amount, unit in matches)
+    return sleep + max(RATELIMIT_PADDING[unit] for _, unit in matches)
+
+
 def launch_chrome(chromedriver_path: Path):
     chrome_options = Options()
     chrome_options.add_argument("--headless")
@@ -81,4 +137,4 @@ def webhook_post(
     for embed in embeds:
         webhook.add_embed(embed)
     webhook.set_content(plain_text_message)
-    webhook.execute()
+    return webhook.execute()